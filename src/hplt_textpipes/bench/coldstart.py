@@ -0,0 +1,60 @@
+import subprocess
+import sys
+from timeit import default_timer as timer
+
+import fire
+
+from hplt_textpipes.bench.traf import read_corpus
+
+TRAF = [sys.executable, '-m', 'hplt_textpipes.stage2.trafilatura.traf']
+
+
+def wall_time(cmd, inp, repeat):
+    best = None
+    for _ in range(repeat):
+        st = timer()
+        subprocess.run(cmd, input=inp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        dur = timer() - st
+        best = dur if best is None else min(best, dur)
+    return best
+
+
+def top_imports(cmd, n):
+    """Returns the n top-level imports taking the longest cumulative time according to python -X importtime."""
+    err = subprocess.run(cmd[:1] + ['-X', 'importtime'] + cmd[1:], input=b'', stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE, check=True).stderr.decode()
+    imports = []
+    for l in err.splitlines():
+        if not l.startswith('import time:') or 'cumulative' in l:
+            continue
+        _, cumulative, name = l.split('|')
+        if name.startswith('  '):
+            continue  # nested imports are included in the cumulative time of the top-level ones
+        imports.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:n]
+
+
+def bench(repeat: int = 5, lid_model: str = None, top: int = 10):
+    """
+    Measures the cold start of traf.py, which is paid by every process started by GNU parallel --block: the best wall
+    time of the interpreter alone, traf.py on empty input and on one document of the synthetic corpus. Also prints
+    the imports taking the longest time.
+
+    :param repeat: number of runs of each command, the best time is reported
+    :param lid_model: also measure traf.py with LID fused using this FastText model
+    :param top: number of imports to print
+    """
+    doc = read_corpus(None, 1)[0]
+    runs = [('python', [sys.executable, '-c', 'pass'], b''), ('traf_empty', TRAF, b''), ('traf_1doc', TRAF, doc)]
+    if lid_model:
+        runs.append(('traf_1doc_lid', TRAF + ['--lid_model', lid_model, '--lang_output', '/dev/null'], doc))
+    print('command\tseconds')
+    for name, cmd, inp in runs:
+        print(f'{name}\t{wall_time(cmd, inp, repeat):.3f}')
+    print('\nimport\tseconds')
+    for seconds, name in top_imports(TRAF, top):
+        print(f'{name}\t{seconds:.3f}')
+
+
+if __name__ == '__main__':
+    fire.Fire(bench)
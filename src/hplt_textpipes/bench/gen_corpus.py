@@ -0,0 +1,109 @@
+import random
+
+import fire
+import orjson
+import zstandard
+
+WORDS = {
+    'en': "the of and to in is that for it with as was on by this be are from at or an which have not they all "
+          "page news people time year world city work life first new more after over other most only".split(),
+    'de': "der die und in den von zu das mit sich des auf für ist im dem nicht ein eine als auch es an werden aus "
+          "er hat dass sie nach wird bei einer um am sind noch wie einem über einen so zum war haben nur".split(),
+    'ru': "и в не на я быть он с что а по это она этот к но они мы как из у который то за свой что весь год от "
+          "так о для ты же все тот мочь вы человек такой его сказать только или ещё бы себя один".split(),
+    'ka': "და არის რომ ეს არ იყო ის როგორც მაგრამ ან კი უნდა მისი თუ ასევე ერთი ყველა მათ რა ძალიან "
+          "საქართველოს ქალაქი წელს ადამიანი დღეს ახალი".split(),
+    'zh': "的 一 是 不 了 在 人 有 我 他 这 个 们 中 来 上 大 为 和 国 地 到 以 说 时 要 就 出 会 可 也 你 对 生 能".split(),
+    'ar': "في من على أن إلى عن مع هذا كان التي الذي بين كل بعد قد هذه ذلك عند لم أو ما هو وقد حيث".split(),
+}
+# snippets matching the rules in mt-filter-list.annotated, one of them through a numeric character reference
+TAGFILTER_SNIPPETS = [
+    '<div id="qtranslate-chooser">x</div>', '<link rel="alternate machine-translated-from" href="x">',
+    '<a onclick="doGTranslate(\'en|de\')">de</a>', '<a data-trp-gettext="">x</a>',
+    '<script src="/wp-content/plugins/qtranslate-x/qtranslate.js"></script>',
+    '<meta name="translation-stats" content="x">', '<div id="&#119;eglot-switcher">x</div>',
+]
+
+
+def sentence(rnd, lang, n):
+    sep = '' if lang == 'zh' else ' '
+    s = sep.join(rnd.choice(WORDS[lang]) for _ in range(n))
+    return s[:1].upper() + s[1:] + ('。' if lang == 'zh' else '.')
+
+
+def paragraph(rnd, lang):
+    return ' '.join(sentence(rnd, lang, rnd.randint(4, 25)) for _ in range(rnd.randint(1, 6)))
+
+
+def boilerplate(rnd, lang):
+    links = ''.join(f'<li><a href="/p{i}">{sentence(rnd, lang, 2)}</a></li>' for i in range(rnd.randint(3, 30)))
+    return (f'<header><div class="logo">Site</div><nav><ul>{links}</ul></nav></header>',
+            f'<footer><p>{sentence(rnd, lang, 8)}</p><p>Copyright 2024</p><ul>{links}</ul></footer>')
+
+
+def body(rnd, lang, scale):
+    parts = []
+    for _ in range(rnd.randint(1, 30) * scale):
+        r = rnd.random()
+        if r < 0.6:
+            parts.append(f'<p>{paragraph(rnd, lang)}</p>')
+        elif r < 0.7:
+            parts.append(f'<h2>{sentence(rnd, lang, 5)}</h2>')
+        elif r < 0.8:
+            parts.append('<ul>' + ''.join(f'<li>{sentence(rnd, lang, 6)}</li>' for _ in range(rnd.randint(2, 8)))
+                         + '</ul>')
+        elif r < 0.88:
+            rows = ''.join(f'<tr><td>{sentence(rnd, lang, 3)}</td><td>{rnd.randint(0, 999)}</td></tr>'
+                           for _ in range(rnd.randint(2, 12)))
+            parts.append(f'<table>{rows}</table>')
+        elif r < 0.94:
+            parts.append('<div class="wrap">' * 15 + f'<p>{paragraph(rnd, lang)}</p>' + '</div>' * 15)
+        else:
+            parts.append(f'<div class="comments"><div class="comment"><p>{paragraph(rnd, lang)}</p></div></div>')
+    return ''.join(parts)
+
+
+def document(rnd):
+    lang = rnd.choice(list(WORDS))
+    # most documents are small, some are large, a few are huge as in real crawls
+    r = rnd.random()
+    scale = 1 if r < 0.9 else 10 if r < 0.98 else 50
+    header, footer = boilerplate(rnd, lang)
+    extra = rnd.choice(TAGFILTER_SNIPPETS) if rnd.random() < 0.1 else ''
+    scripts = '<script>var x = {"a": 1};</script><style>p {margin: 0}</style>' * rnd.randint(0, 5)
+    return (f'<!DOCTYPE html><html lang="{lang}"><head><meta charset="utf-8">'
+            f'<meta http-equiv="content-language" content="{lang}"><meta property="og:locale" content="{lang}_XX">'
+            f'<title>{sentence(rnd, lang, 6)}</title>{scripts}</head><body>{header}'
+            f'<main><article><h1>{sentence(rnd, lang, 6)}</h1>{body(rnd, lang, scale)}</article></main>{extra}'
+            f'{footer}</body></html>')
+
+
+def generate(fpath: str, ndocs: int = 300, seed: int = 1):
+    """
+    Generates a synthetic html.zst for benchmarks: jsonlines with documents in the 'h' field as in the outputs of
+    stage1. The corpus is deterministic for the same arguments. Besides typical pages it has a few huge ones, pages
+    matching the tag filters, and some corrupted lines (invalid UTF-8, lone surrogates, empty HTMLs, non-HTML input).
+    The corpus checked in at data/synthetic.html.zst is generated with the default arguments.
+
+    :param fpath: the output path
+    :param ndocs: number of documents
+    :param seed: random seed
+    """
+    rnd = random.Random(seed)
+    with zstandard.open(fpath, 'wb', cctx=zstandard.ZstdCompressor(level=19)) as f:
+        for _ in range(ndocs):
+            r = rnd.random()
+            if r < 0.01:
+                f.write(b'{"h": "<html><body><p>invalid \xff\xfe utf-8 ' + b'text ' * 50 + b'</p></body></html>"}\n')
+            elif r < 0.02:
+                f.write(b'{"h": "<html><body><p>lone \\ud800 surrogate ' + b'text ' * 50 + b'</p></body></html>"}\n')
+            elif r < 0.03:
+                f.write(b'{"h": ""}\n')
+            elif r < 0.04:
+                f.write(orjson.dumps({'h': 'plain text ' * rnd.randint(1, 100)}) + b'\n')
+            else:
+                f.write(orjson.dumps({'h': document(rnd)}) + b'\n')
+
+
+if __name__ == '__main__':
+    fire.Fire(generate)
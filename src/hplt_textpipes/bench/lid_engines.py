@@ -0,0 +1,109 @@
+import sys
+from copy import copy
+from timeit import default_timer as timer
+
+import fire
+import numpy
+import regex
+
+from hplt_textpipes.bench.lid_preprocess import EDGE_CASES, read_texts
+from hplt_textpipes.lid.engine import LidEngine
+from hplt_textpipes.lid.patterns import NONWORD_REPLACE_PATTERN, SPACE_PATTERN
+from hplt_textpipes.lid.registry import preprocessing_for, resolve_model_path
+
+
+# the implementations of LID replaced by LidEngine, as they were in each entry point
+
+
+def stage2_lid(model, text):
+    """stage2 FastTextLangId.predict_text(): newlines replaced before stripping."""
+    if text is None or len(text) == 0:
+        return {'lang': None}
+    text = text.replace('\n', ' ').strip().lower()
+    text = regex.sub(SPACE_PATTERN, ' ', text)
+    text = regex.sub(NONWORD_REPLACE_PATTERN, '', text)
+    labels, probs = model.predict(text=text, k=3, threshold=0.0, on_unicode_error='strict')
+    return {'lang': [label.replace('__label__', '') for label in labels],
+            'prob': numpy.round(numpy.asarray(probs, dtype=numpy.float64), decimals=4).tolist()}
+
+
+def stage3_lid(model, text, identity):
+    """stage3 FastTextLangId per line: stripped before replacing newlines, only newlines replaced for GlotLID."""
+    if text is None or len(text) == 0:
+        return {'lang': None}
+    if 'openlid' in identity:
+        text = text.strip().replace('\n', ' ').lower()
+        text = regex.sub(SPACE_PATTERN, ' ', text)
+        text = regex.sub(NONWORD_REPLACE_PATTERN, '', text)
+    else:
+        text = text.replace('\n', ' ')
+    labels, probs = model.predict(text=text, k=3, threshold=0.0, on_unicode_error='strict')
+    return {'lang': [label.removeprefix('__label__') for label in labels],
+            'prob': numpy.round(numpy.asarray(probs, dtype=numpy.float64), decimals=4).tolist()}
+
+
+def zstdconcat_lid(model, text, identity):
+    """tools/zstdconcat.py lid(): Python round() of the float64 probabilities, stripping also for GlotLID."""
+    if text in {None, ''}:
+        return {'lang': None}
+    if 'openlid' in identity:
+        text = text.strip().replace('\n', ' ').lower()
+        text = SPACE_PATTERN.sub(' ', text)
+        text = NONWORD_REPLACE_PATTERN.sub('', text)
+    else:
+        text = text.strip().replace('\n', ' ')
+    labels, probs = model.predict(text=text, k=3, threshold=0.0, on_unicode_error='strict')
+    return {'lang': [label.removeprefix('__label__') for label in labels],
+            'prob': [float(round(p, 4)) for p in probs]}
+
+
+def bench(fpath: str = None, identity: tuple = ('openlid-v3', 'glotlid-v3'), field: str = 't', limit: int = None,
+          batch_size: int = 1000):
+    """
+    Checks that LidEngine returns the same as each of the implementations it replaced, for each model identity, over
+    the texts of a shard and the edge cases of preprocessing. Prints the number of texts for which the results differ
+    from each implementation, the first differing text, and the time per text of the old per-line prediction in
+    stage3 and of LidEngine.predict_batch().
+
+    :param fpath: jsonl or jsonl.zst with the texts, e.g. text.zst of stage2; only the edge cases by default
+    :param identity: the identities of the models, found as in proto_langid.py of stage3
+    :param field: the field of the texts in fpath
+    :param limit: use only this many first texts of fpath
+    :param batch_size: the number of texts passed to predict_batch() at once
+    """
+    texts = (read_texts(fpath, field, limit) if fpath else []) + EDGE_CASES + [None]
+    texts += [' ' + t for t in EDGE_CASES if t]  # whitespace at the start, which FastText does not ignore
+    print('identity\timplementation\tmismatches\told_us_per_text\tengine_us_per_text')
+    for ident in [identity] if isinstance(identity, str) else identity:
+        model_path = resolve_model_path(ident)
+        if model_path is None:
+            sys.exit(f'Missing model file for {ident}')
+        engine = LidEngine(model_path, ident)
+        st = timer()
+        results = [r for i in range(0, len(texts), batch_size) for r in engine.predict_batch(texts[i:i + batch_size])]
+        engine_seconds = timer() - st
+        # zstdconcat.py keeps stripping the texts for the models with the newlines preprocessing, see preprocessing.py
+        zstdconcat_results = results
+        if preprocessing_for(ident) == 'newlines':
+            zstdconcat_engine = copy(engine)
+            zstdconcat_engine.preprocessing = 'newlines_stripped'
+            zstdconcat_results = [r for i in range(0, len(texts), batch_size)
+                                  for r in zstdconcat_engine.predict_batch(texts[i:i + batch_size])]
+        old = [('stage3', lambda t: stage3_lid(engine.model, t, ident), results),
+               ('zstdconcat', lambda t: zstdconcat_lid(engine.model, t, ident), zstdconcat_results)]
+        if preprocessing_for(ident) == 'openlid':
+            old.insert(0, ('stage2', lambda t: stage2_lid(engine.model, t), results))
+        for name, lid, engine_results in old:
+            st = timer()
+            expected = [lid(t) for t in texts]
+            seconds = timer() - st
+            diff = [i for i, (a, b) in enumerate(zip(engine_results, expected)) if a != b]
+            print(f'{ident}\t{name}\t{len(diff)}\t{seconds / len(texts) * 1e6:.0f}\t'
+                  f'{engine_seconds / len(texts) * 1e6:.0f}')
+            if diff:
+                i = diff[0]
+                print(f'  first mismatch {texts[i]!r:.80}: {engine_results[i]} != {expected[i]}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    fire.Fire(bench)
@@ -0,0 +1,64 @@
+import sys
+from timeit import default_timer as timer
+
+import fire
+
+from hplt_textpipes.bench.lid_preprocess import read_texts
+from hplt_textpipes.lid.prefix_sampler import PrefixSampler
+from hplt_textpipes.stage3.fastertext_lid.proto_langid import FastTextLangId, resolve_model_path
+
+
+def top1(result):
+    return result['lang'][0] if result['lang'] else None
+
+
+def predict(model, texts, batch_size):
+    st = timer()
+    results = [r for i in range(0, len(texts), batch_size) for r in model.predict_batch(texts[i:i + batch_size])]
+    return results, timer() - st
+
+
+def bench(fpath: str, identity: str = 'openlid-v3', model_path: str = None, field: str = 't', limit: int = None,
+          prefix_chars: tuple = (500, 1000, 2000, 5000), min_prob: tuple = (0.5, 0.7, 0.9), sample_lines: int = 0,
+          batch_size: int = 1000):
+    """
+    Compares the LID on samples of long texts (see PrefixSampler) with the LID on the full texts for a stage3 shard:
+    for each prefix length and minimal probability prints the time per text, the share of the long texts escalated
+    to the full text and the agreement of the top-1 labels and of the top-3 labels with the full-text predictions, over
+    all texts and over the long ones only.
+
+    :param fpath: jsonl or jsonl.zst with the texts, e.g. text.zst of stage2
+    :param identity: the identity of the model, it is found as in proto_langid.py unless model_path is given
+    :param field: the field of the texts in fpath
+    :param limit: use only this many first texts of fpath
+    :param prefix_chars: the prefix lengths to try
+    :param min_prob: the minimal top-1 probabilities to try
+    :param sample_lines: the number of lines in the second sample, see PrefixSampler
+    :param batch_size: the number of texts passed to predict_batch() at once
+    """
+    model = resolve_model_path(identity, model_path)
+    if model is None:
+        sys.exit(f'Missing model file for {identity}')
+    lid = FastTextLangId(model, identity=identity, text_field=field)
+    texts = read_texts(fpath, field, limit)
+    full, full_seconds = predict(lid, texts, batch_size)
+    nchars = sum(len(t) for t in texts)
+    print(f'{len(texts)} texts, {nchars / max(len(texts), 1):.0f} characters per text on average', file=sys.stderr)
+    print('prefix_chars\tmin_prob\tlong_texts\tescalated\tus_per_text\tspeedup\ttop1_agree\ttop1_agree_long\t'
+          'top3_agree')
+    print(f'full\t-\t-\t-\t{full_seconds / len(texts) * 1e6:.0f}\t1.00\t-\t-\t-')
+    for n in prefix_chars:
+        long_ids = [i for i, t in enumerate(texts) if t and len(t) > n]
+        for p in min_prob:
+            lid.prefix_sampler = PrefixSampler(n, p, sample_lines)
+            results, seconds = predict(lid, texts, batch_size)
+            sampled, escalated = lid.prefix_sampler.counts
+            top1_agree = sum(top1(a) == top1(b) for a, b in zip(results, full)) / len(texts)
+            top1_agree_long = sum(top1(results[i]) == top1(full[i]) for i in long_ids) / max(len(long_ids), 1)
+            top3_agree = sum(a['lang'] == b['lang'] for a, b in zip(results, full)) / len(texts)
+            print(f'{n}\t{p}\t{sampled}\t{escalated / max(sampled, 1):.3f}\t{seconds / len(texts) * 1e6:.0f}\t'
+                  f'{full_seconds / seconds:.2f}\t{top1_agree:.4f}\t{top1_agree_long:.4f}\t{top3_agree:.4f}')
+
+
+if __name__ == '__main__':
+    fire.Fire(bench)
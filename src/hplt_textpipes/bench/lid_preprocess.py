@@ -0,0 +1,100 @@
+import io
+import random
+import sys
+from timeit import default_timer as timer
+
+import fire
+import ujson
+import zstandard
+
+from hplt_textpipes.bench.gen_corpus import WORDS
+from hplt_textpipes.lid.patterns import NONWORD_REPLACE_PATTERN, SPACE_PATTERN
+from hplt_textpipes.lid.preprocessing import preprocess_text as preprocess_stripped_first
+from hplt_textpipes.lid.preprocessing import preprocess_texts, SENTINEL, LATIN1_SENTINEL
+
+# texts around the corner cases of preprocess_texts(): the final sigma at the ends of the texts, whitespace at the ends
+# and in runs, characters which are whitespace for str.strip() but not for regex \s, digits, punctuation, control
+# characters, empty texts and the sentinels themselves
+EDGE_CASES = [
+    '', ' ', '\n', '\n\n \t', 'ΟΔΟΣ', 'ΟΔΟΣ ', 'Σ', 'ΑΣ.', 'ΑΣ1', '  ΟΔΟΣ\nΚΑΙ ΣΟΦΙΑ  ', 'İSTANBUL ıi', 'Straße ẞ',
+    'a\u001cb', '\u001c', '\u001ca\u001f', 'a\x85b\x85', 'a  b', 'a \t\n\r\x0b\x0c b', 'a  b',
+    '123 abc 4.5', '٣٤ ١٢', 'e-mail: a@b.c!', '😀 emoji 👍🏽', 'é combining', 'מילה עברית', 'ﬁ ligature',
+    'Ab\x7f\x01\x1f_', SENTINEL, 'ΟΔΟΣ' + SENTINEL + 'ΟΔΟΣ', LATIN1_SENTINEL, 'x' + LATIN1_SENTINEL + 'Y',
+    'ÀΣ' + LATIN1_SENTINEL + '\xa0', 'ÀÉÎ Ÿÿ ß µ ª º × ÷ ¹²³ ¼ ¿¡ «» ÞÐ', '\xa0\xa0x\xa0 y', 'a\x85\x85b\x85 c', '\xa0',
+]
+
+
+def preprocess_text(text):
+    """The openlid preprocessing of a single text as stage2 did it before the LID engine, newlines replaced first."""
+    text = text.replace('\n', ' ').strip().lower()
+    text = SPACE_PATTERN.sub(' ', text)
+    return NONWORD_REPLACE_PATTERN.sub('', text)
+
+
+def generate_texts(n, seed=0):
+    """Texts in several languages from the words of the synthetic corpus, mixing whitespace and edge cases."""
+    rnd = random.Random(seed)
+    seps = [' ', ' ', ' ', '\n', '  ', '\t', ', ', '. ', ' 42 ', ' - ', '\n\n']
+    texts = []
+    for _ in range(n):
+        lang = rnd.choice(list(WORDS))
+        words = [rnd.choice(WORDS[lang]) for _ in range(rnd.randint(0, 60))]
+        if rnd.random() < 0.1:
+            words.append(rnd.choice(EDGE_CASES))
+        rnd.shuffle(words)
+        text = ''.join(w + rnd.choice(seps) for w in words)
+        texts.append(text.upper() if rnd.random() < 0.2 else text)
+    return texts
+
+
+def read_texts(fpath, field, limit):
+    with io.BufferedReader(zstandard.open(fpath, 'rb')) if fpath.endswith('.zst') else open(fpath, 'rb') as inp:
+        return [ujson.loads(l)[field] or '' for i, l in enumerate(inp) if limit is None or i < limit]
+
+
+def bench(fpath: str = None, field: str = 't', limit: int = None, n: int = 10000, batch_size: int = 1000,
+          repeat: int = 5):
+    """
+    Checks that preprocess_texts() and lid.preprocessing.preprocess_text(), which strips before replacing newlines as
+    stage3 did, return exactly the same as the stage2 preprocessing of a single text, and compares the speed of
+    preprocess_texts() with the latter per text. Runs over the edge cases in EDGE_CASES, each in a batch of its own
+    and all in one batch, and over the texts in batches of batch_size. Exits with code 1 if any result differs.
+
+    :param fpath: jsonl or jsonl.zst with the texts, e.g. the text output of stage2; by default texts are generated
+    from the words of the synthetic corpus in several languages
+    :param field: the field of the texts in fpath
+    :param limit: use only this many first texts of fpath
+    :param n: the number of texts to generate if fpath is not given
+    :param batch_size: the number of texts passed to preprocess_texts() at once
+    :param repeat: number of runs over all texts, the best time is reported
+    """
+    texts = read_texts(fpath, field, limit) if fpath else generate_texts(n)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    batches += [[t] for t in EDGE_CASES] + [EDGE_CASES]
+
+    expected = [[preprocess_text(t) for t in batch] for batch in batches]
+    mismatches = sum(a != b for batch, exp in zip(batches, expected)
+                     for a, b in zip(preprocess_texts(batch), exp, strict=True))
+    mismatches += sum(preprocess_stripped_first(t) != e for batch, exp in zip(batches, expected)
+                      for t, e in zip(batch, exp))
+
+    def best_time(func):
+        best = None
+        for _ in range(repeat):
+            st = timer()
+            func()
+            dur = timer() - st
+            best = dur if best is None else min(best, dur)
+        return best
+
+    ntexts = sum(len(batch) for batch in batches)
+    single = best_time(lambda: [preprocess_text(t) for batch in batches for t in batch])
+    batched = best_time(lambda: [preprocess_texts(batch) for batch in batches])
+    print('texts\tsingle_us_per_text\tbatched_us_per_text\tspeedup\tmismatches')
+    print(f'{ntexts}\t{single / ntexts * 1e6:.1f}\t{batched / ntexts * 1e6:.1f}\t{single / batched:.2f}\t{mismatches}')
+    if mismatches:
+        sys.exit(f'lid_preprocess.py: {mismatches} preprocessed texts differ from the stage2 preprocessing')
+
+
+if __name__ == '__main__':
+    fire.Fire(bench)
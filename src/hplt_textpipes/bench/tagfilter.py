@@ -0,0 +1,84 @@
+import sys
+from functools import partial
+from timeit import default_timer as timer
+
+import fire
+from trafilatura.utils import load_html
+
+from hplt_textpipes.bench.traf import read_corpus
+from hplt_textpipes.stage2.trafilatura.traf import parse_input, UNDECODABLE
+from hplt_textpipes.stage2.tagfilter.tagfilter1 import TagFilter1
+from hplt_textpipes.stage2.tagfilter.tagfilter2 import TagFilter2, ahocorasick
+from hplt_textpipes.stage2.tagfilter.prescreen import TagFilterPrescreen
+
+MATCHERS = {'tagfilter1': TagFilter1, 'tagfilter2': TagFilter2,
+            'tagfilter2_automaton': partial(TagFilter2, backend='automaton')}
+
+
+def load_trees(lines):
+    """Returns the input lines with HTMLs which could be parsed and the trees, and the flags of decoding errors."""
+    parsed, trees, undecodable = [], [], []
+    for byteline in lines:
+        errors = []
+        d = parse_input(byteline, 'ignore', errors)
+        tree = load_html(d['h']) if d is not UNDECODABLE else None
+        if tree is not None:
+            parsed.append(byteline)
+            trees.append(tree)
+            undecodable.append(bool(errors))
+    return parsed, trees, undecodable
+
+
+def bench(fpath: str = None, matchers: str = None, limit: int = None, repeat: int = 5):
+    """
+    Benchmark for the tag filter matchers used by traf.py: runs matches() of each matcher over the same parsed HTMLs,
+    reports time per document and the speedup relative to the first matcher. Also checks that all matchers return
+    the same results as the first one. Parsing the HTMLs is not included in the time.
+    The last row is for TagFilterPrescreen over the input lines as in traf_doc(): the number of documents passed to the
+    matcher, the time of the prescreen alone, and as mismatches the false negatives, i.e. the documents skipped though
+    the first matcher matched them, which should be 0.
+
+    :param fpath: html.zst with HTMLs, by default the synthetic corpus checked in at bench/data
+    :param matchers: comma-separated list of matchers among tagfilter1, tagfilter2, tagfilter2_automaton, by default
+    all of them, except tagfilter2_automaton if pyahocorasick is not installed
+    :param limit: use only this many first documents
+    :param repeat: number of runs over all documents for each matcher, the best time is reported
+    """
+    if matchers is None:
+        matchers = list(MATCHERS)
+        if ahocorasick is None:
+            print('pyahocorasick is not installed, skipping tagfilter2_automaton', file=sys.stderr)
+            matchers.remove('tagfilter2_automaton')
+    matchers = matchers.split(',') if isinstance(matchers, str) else list(matchers)
+    lines, trees, undecodable = load_trees(read_corpus(fpath, limit))
+    print(f'{len(trees)} documents parsed', file=sys.stderr)
+
+    print('matcher\tdocs\tmatched\tus_per_doc\tspeedup\tmismatches')
+    base_results, base_time = None, None
+    for name in matchers:
+        matcher = MATCHERS[name]()
+        best = None
+        for _ in range(repeat):
+            st = timer()
+            results = [matcher.matches(tree) for tree in trees]
+            dur = timer() - st
+            best = dur if best is None else min(best, dur)
+        if base_results is None:
+            base_results, base_time = results, best
+        mismatches = sum(a != b for a, b in zip(base_results, results))
+        matched = sum(r is not None for r in results)
+        print(f'{name}\t{len(trees)}\t{matched}\t{best / len(trees) * 1e6:.1f}\t{base_time / best:.2f}\t{mismatches}')
+
+    prescreen = TagFilterPrescreen()
+    best = None
+    for _ in range(repeat):
+        st = timer()
+        passed = [u or prescreen.may_match(line) for line, u in zip(lines, undecodable)]
+        dur = timer() - st
+        best = dur if best is None else min(best, dur)
+    false_negatives = sum(r is not None and not p for r, p in zip(base_results, passed))
+    print(f'prescreen\t{len(lines)}\t{sum(passed)}\t{best / len(lines) * 1e6:.1f}\t-\t{false_negatives}')
+
+
+if __name__ == '__main__':
+    fire.Fire(bench)
@@ -0,0 +1,114 @@
+import io
+import json
+import multiprocessing
+import resource
+import sys
+from collections import Counter
+from contextlib import nullcontext
+from importlib.resources import files
+from timeit import default_timer as timer
+
+import fire
+import numpy
+import trafilatura
+import zstandard
+from trafilatura.utils import load_html
+
+from hplt_textpipes.stage2.trafilatura.traf import traf_config, parse_input, time_limit, CustomTimeoutError, \
+    extract_two_pass, extract_single_pass, UNDECODABLE, TRAFILATURA_TEXT_OPTIONS, TRAFILATURA_XML_OPTIONS
+
+
+def extract_text(tree, config):
+    return trafilatura.extract(tree, config=config, **TRAFILATURA_TEXT_OPTIONS), None
+
+
+def extract_xml(tree, config):
+    return None, trafilatura.extract(tree, output_format='xml', config=config, **TRAFILATURA_XML_OPTIONS)
+
+
+# combined is what traf.py does by default, single_pass is traf.py --single_pass
+MODES = {'text': extract_text, 'xml': extract_xml, 'combined': extract_two_pass, 'single_pass': extract_single_pass}
+DEFAULT_CORPUS = 'data/synthetic.html.zst'
+
+
+def read_corpus(fpath, limit):
+    if fpath is None:
+        fpath = files('hplt_textpipes.bench').joinpath(DEFAULT_CORPUS)
+    with io.BufferedReader(zstandard.open(fpath, 'rb')) as inp:
+        return [l for i, l in enumerate(inp) if limit is None or i < limit]
+
+
+def run_mode(mode, lines, timelimit_perdoc, repeat):
+    """
+    Runs one extraction mode over the lines repeat times, returns the metrics. Each document is processed as in
+    traf_doc(): parsing the input line, parsing the HTML and extraction, under the same time limit.
+    """
+    extract = MODES[mode]
+    config = traf_config()
+    cnt = Counter()
+    latencies = []
+    st = timer()
+    for _ in range(repeat):
+        for byteline in lines:
+            doc_st = timer()
+            try:
+                d = parse_input(byteline, 'ignore', [])
+                with time_limit(timelimit_perdoc) if timelimit_perdoc else nullcontext():
+                    tree = load_html(d['h']) if d is not UNDECODABLE else None
+                    if tree is not None:
+                        extract(tree, config)
+            except CustomTimeoutError:
+                cnt['timeouts'] += 1
+            except Exception:
+                cnt['errors'] += 1
+            latencies.append(timer() - doc_st)
+    total = timer() - st
+    ndocs = len(lines) * repeat
+    mb = sum(len(l) for l in lines) * repeat / 2**20
+    p50, p95, p99 = numpy.percentile(latencies, [50, 95, 99]) * 1000
+    return {'mode': mode, 'docs': ndocs, 'MB': round(mb, 2), 'seconds': round(total, 2),
+            'docs_per_s': round(ndocs / total, 1), 'MB_per_s': round(mb / total, 2),
+            'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2),
+            'timeout_rate': round(cnt['timeouts'] / ndocs, 4), 'error_rate': round(cnt['errors'] / ndocs, 4),
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_MB': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def bench(fpath: str = None, modes: str = ','.join(MODES), limit: int = None, repeat: int = 1,
+          timelimit_perdoc: float = 10, json_output: str = None):
+    """
+    Throughput benchmark for the extraction in traf.py. For each extraction mode reports docs/s, MB/s of the input,
+    percentiles of per-document latency, the rates of timeouts and errors, and peak RSS. Each mode runs in a fresh
+    process, so that peak RSS is measured for this mode only and modes do not warm up caches for each other.
+    Writes a table to stdout.
+
+    :param fpath: html.zst to run on, by default the synthetic corpus checked in at bench/data (see gen_corpus.py)
+    :param modes: comma-separated list of modes among text, xml, combined, single_pass
+    :param limit: use only this many first documents
+    :param repeat: process the documents this many times
+    :param timelimit_perdoc: time limit per document in seconds as in traf.py
+    :param json_output: also write the results as jsonlines to this file, e.g. to compare them between commits
+    """
+    modes = modes.split(',') if isinstance(modes, str) else list(modes)
+    if unknown := set(modes) - set(MODES):
+        raise ValueError(f'Unknown modes {unknown}, select among {list(MODES)}')
+    lines = read_corpus(fpath, limit)
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    for mode in modes:
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(run_mode, (mode, lines, timelimit_perdoc, repeat)))
+        print(f'{mode} done', file=sys.stderr)
+
+    keys = list(results[0])
+    print('\t'.join(keys))
+    for r in results:
+        print('\t'.join(str(r[k]) for k in keys))
+    if json_output:
+        with open(json_output, 'w') as f:
+            for r in results:
+                f.write(json.dumps(r) + '\n')
+
+
+if __name__ == '__main__':
+    fire.Fire(bench)
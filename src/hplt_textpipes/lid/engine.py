@@ -0,0 +1,217 @@
+"""
+The FastText LID engine shared by stage2, stage3 and tools/zstdconcat.py: batched prediction with the preprocessing
+of the model identity, the same rounding of the probabilities everywhere, and the optional script short-circuit,
+prediction on samples of long texts, per-line results and cache of results.
+"""
+from __future__ import annotations
+
+import fasttext
+import numpy
+
+from hplt_textpipes.lid.prefix_sampler import PrefixSampler
+from hplt_textpipes.lid.preprocessing import PREPROCESSORS
+from hplt_textpipes.lid.registry import preprocessing_for
+from hplt_textpipes.lid.script_filter import ScriptShortCircuit
+from hplt_textpipes.utils.lid_cache import LidCache
+
+
+def round_probs(probs) -> list[float]:
+    """
+    Rounds the probabilities predicted by FastText to 4 decimals.
+
+    Example: [0.92134414] -> [0.9213]
+    """
+    # predicting for a list of texts returns float32, rounding it would give e.g. 0.9212999939918518; predicting for
+    # a single text returns the same values as float64
+    return numpy.round(numpy.asarray(probs, dtype=numpy.float64), decimals=4).tolist()
+
+
+class LidEngine:
+    """
+    A FastText LID model predicting for batches of texts.
+
+    :param model_path: the model file, see registry.resolve_model_path()
+    :param identity: the identity of the model, e.g. openlid-v3, which selects the preprocessing of the texts
+    :param preprocessing: the name of the preprocessing in PREPROCESSORS instead of the one of the identity
+    :param script_shortcircuit: do not run the model for the texts whose script is used by only one label of the
+    model, see ScriptShortCircuit
+    :param prefix_chars: predict for the texts longer than that on their first prefix_chars characters (and on
+    prefix_sample_lines lines spread over them) and for the full text only if the prediction is not confident, see
+    PrefixSampler
+    :param segments: the results written by the stage3 script for each text also have the top-1 language of each of
+    its lines, see predict_segments()
+    :param lid_cache: take the results for the preprocessed texts seen before from the cache, see LidCache
+    """
+    def __init__(
+        self,
+        model_path: str,
+        identity: str | None = None,
+        *,
+        preprocessing: str | None = None,
+        script_shortcircuit: bool = False,
+        script_min_share: float = 0.99,
+        script_verify: bool = False,
+        prefix_chars: int = 0,
+        prefix_min_prob: float = 0.9,
+        prefix_sample_lines: int = 0,
+        segments: bool = False,
+        lid_cache: LidCache | None = None,
+    ) -> None:
+        self.identity = identity
+        self.preprocessing = preprocessing_for(identity) if preprocessing is None else preprocessing
+        if self.preprocessing not in PREPROCESSORS:
+            raise ValueError(f"Unknown preprocessing {self.preprocessing}, select among {list(PREPROCESSORS)}")
+        self.model = fasttext.load_model(model_path)
+        self.script_filter = ScriptShortCircuit(self.model.get_labels(), script_min_share, script_verify) \
+            if script_shortcircuit else None
+        self.prefix_sampler = PrefixSampler(prefix_chars, prefix_min_prob, prefix_sample_lines) \
+            if prefix_chars else None
+        self.segments = segments
+        self.lid_cache = lid_cache
+
+    def _postprocess_predicted_labels(self, prediction: tuple) -> list[str]:
+        """
+        Postprocess the predicted labels.
+
+        Example: "__label__eng_Latn" -> "eng_Latn"
+        """
+        return [label.removeprefix("__label__") for label in prediction[0]]
+
+    def _postprocess_predicted_probabilities(self, prediction: tuple) -> list[float]:
+        return round_probs(prediction[1])
+
+    def _preprocessed(self, cache: dict, keys: list, texts: list[str]) -> list[str]:
+        """Preprocess the texts for the model, the cache maps their keys to the texts already preprocessed."""
+        if missing := [(key, text) for key, text in zip(keys, texts) if key not in cache]:
+            processed = PREPROCESSORS[self.preprocessing]([text for _, text in missing])
+            cache.update(zip([key for key, _ in missing], processed))
+        return [cache[key] for key in keys]
+
+    def _predict(self, texts: list[str], k: int = 3) -> list[dict]:
+        """
+        Predict the top k labels for the preprocessed texts with a single call to the model. With lid_cache, only the
+        texts not found in the cache are predicted for, once for each distinct text.
+        """
+        if self.lid_cache is None:
+            return self._predict_uncached(texts, k)
+        keys, results = self.lid_cache.get_many(f"{self.identity}\tk={k}", texts)
+        misses = {}
+        for i, result in enumerate(results):
+            if result is None:
+                misses.setdefault(texts[i], []).append(i)
+        if misses:
+            predicted = self._predict_uncached(list(misses), k)
+            self.lid_cache.put_many([keys[ids[0]] for ids in misses.values()], predicted)
+            for ids, result in zip(misses.values(), predicted):
+                for i in ids:
+                    # the results of the duplicates are separate objects, the caller may update them
+                    results[i] = dict(result)
+        return results
+
+    def _predict_uncached(self, texts: list[str], k: int) -> list[dict]:
+        labels, probs = self.model.predict(
+            text=texts,
+            k=k,
+            threshold=0.0,
+            on_unicode_error="strict",
+        )
+        return [{"lang": self._postprocess_predicted_labels(prediction),
+                 "prob": self._postprocess_predicted_probabilities(prediction)}
+                for prediction in zip(labels, probs)]
+
+    def predict_text(self, text: str | None) -> dict:
+        """
+        Predict the language of a single text, the same as predict_batch() for it.
+
+        Example output:
+
+        {"lang": ["eng_Latn", "sco_Latn", "fra_Latn"], "prob": [0.9213, 0.0412, 0.0031]}
+
+        """
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts: list[str | None], preprocessed: dict | None = None) -> list[dict]:
+        """
+        Predict the languages of a batch of texts with a single call to the model, in the order of the texts.
+        The result for a text which is None or empty is {"lang": None}. With script_shortcircuit, the result for a text
+        settled by its script is {"lang": [label], "prob": [1.0], "shortcut": true}, see ScriptShortCircuit. With
+        prefix_chars, the model is called first for the samples of the long texts and then for the other texts and the
+        escalated ones, see PrefixSampler.
+
+        :param preprocessed: the cache of the preprocessed texts shared by several models predicting for the same batch,
+        models with the same preprocessing preprocess each text once
+        """
+        results = [{"lang": None} for _ in texts]
+        ids = [i for i, text in enumerate(texts) if text is not None and len(text) != 0]
+        if not ids:
+            return results
+
+        shortcut = {}
+        if self.script_filter is not None:
+            shortcut = {i: label for i in ids if (label := self.script_filter.label(texts[i])) is not None}
+            for i, label in shortcut.items():
+                results[i] = {"lang": [label], "prob": [1.0], "shortcut": True}
+            self.script_filter.count(len(ids), len(shortcut))
+            if not self.script_filter.verify:
+                ids = [i for i in ids if i not in shortcut]
+            if not ids:
+                return results
+
+        cache = {} if preprocessed is None else preprocessed.setdefault(self.preprocessing, {})
+        predictions = {}
+        if self.prefix_sampler is not None:
+            samples = {i: text_samples for i in ids
+                       if (text_samples := self.prefix_sampler.samples(texts[i])) is not None}
+            if samples:
+                # the samples are cached under (index of the text, index of the sample)
+                keys = [(i, j) for i, text_samples in samples.items() for j in range(len(text_samples))]
+                sample_texts = [samples[i][j] for i, j in keys]
+                sample_predictions = dict(zip(keys, self._predict(self._preprocessed(cache, keys, sample_texts))))
+                escalated = 0
+                for i, text_samples in samples.items():
+                    text_predictions = [sample_predictions[i, j] for j in range(len(text_samples))]
+                    if self.prefix_sampler.confident(text_predictions):
+                        predictions[i] = text_predictions[0]
+                    else:
+                        escalated += 1
+                self.prefix_sampler.count(len(samples), escalated)
+        full = [i for i in ids if i not in predictions]
+        if full:
+            predictions.update(zip(full, self._predict(self._preprocessed(cache, full, [texts[i] for i in full]))))
+        disagreements = 0
+        for i in ids:
+            result = predictions[i]
+            if i in shortcut and result["lang"][0] != shortcut[i]:
+                disagreements += 1
+            results[i] = result
+        if disagreements:
+            self.script_filter.count(0, 0, disagreements)
+        return results
+
+    def predict_segments(self, texts: list[str | None], preprocessed: dict | None = None) -> list[dict | None]:
+        """
+        Predict the top-1 language of each line of a batch of texts with a single call to the model for all their lines.
+        The result for a text is {"seg_lang": [...], "seg_prob": [...]} with an entry for each line of the text, which
+        is null for the lines with nothing left after preprocessing, or None if the text is None or empty.
+
+        :param preprocessed: the cache of the preprocessed texts, see predict_batch()
+        """
+        cache = {} if preprocessed is None else preprocessed.setdefault(self.preprocessing, {})
+        # the lines are cached under ("line", index of the text, index of the line)
+        nlines, keys, lines = {}, [], []
+        for i, text in enumerate(texts):
+            if text is None or len(text) == 0:
+                continue
+            text_lines = text.split("\n")
+            nlines[i] = len(text_lines)
+            keys.extend(("line", i, j) for j in range(len(text_lines)))
+            lines.extend(text_lines)
+        keys = [key for key, line in zip(keys, self._preprocessed(cache, keys, lines)) if len(line) != 0]
+        predictions = dict(zip(keys, self._predict([cache[key] for key in keys], k=1))) if keys else {}
+
+        results = [None] * len(texts)
+        for i, n in nlines.items():
+            line_predictions = [predictions.get(("line", i, j)) for j in range(n)]
+            results[i] = {"seg_lang": [p and p["lang"][0] for p in line_predictions],
+                          "seg_prob": [p and p["prob"][0] for p in line_predictions]}
+        return results
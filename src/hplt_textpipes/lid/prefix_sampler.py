@@ -0,0 +1,73 @@
+"""
+LID on samples of long texts: the model is run on the first characters of a text, optionally also on a sample of its
+lines, and on the full text only if the predictions for the samples are not confident or disagree. The cost of the
+prediction for multi-megabyte texts then does not grow with their length.
+"""
+from __future__ import annotations
+
+import multiprocessing
+import sys
+
+
+def cut_prefix(text: str, nchars: int) -> str:
+    """Returns the first nchars characters of the text, without the last word if it may be cut in the middle."""
+    if len(text) <= nchars:
+        return text
+    prefix = text[:nchars]
+    end = max(prefix.rfind(" "), prefix.rfind("\n"))
+    return prefix[:end] if end > nchars // 2 else prefix
+
+
+def sample_lines(text: str, nlines: int) -> str | None:
+    """Returns nlines lines spread evenly over the text joined by newlines, or None if the text has not more lines."""
+    lines = text.split("\n")
+    if len(lines) <= nlines:
+        return None
+    step = len(lines) / nlines
+    return "\n".join(lines[int((j + 0.5) * step)] for j in range(nlines))
+
+
+class PrefixSampler:
+    """
+    Selects the samples of long texts to predict for instead of the full texts: the first prefix_chars characters and,
+    if sample_lines is given, sample_lines lines spread over the text, also cut to prefix_chars characters. A text is
+    escalated to the prediction for the full text if the top-1 probability for any sample is below min_prob or the
+    top-1 labels for the samples differ, otherwise the prediction for the prefix is the result.
+
+    :param prefix_chars: the number of characters of the samples, texts not longer than that are predicted for in full
+    :param min_prob: the minimal top-1 probability for a sample to keep its prediction
+    :param sample_lines: the number of lines in the second sample, 0 for the prefix only
+    :param counts: the counters of sampled and escalated texts, pass the counts of another instance to share them
+    between processes
+    """
+    def __init__(self, prefix_chars: int, min_prob: float = 0.9, sample_lines: int = 0, counts=None) -> None:
+        self.prefix_chars = prefix_chars
+        self.min_prob = min_prob
+        self.sample_lines = sample_lines
+        self.counts = multiprocessing.Array("q", 2) if counts is None else counts
+
+    def samples(self, text: str) -> list[str] | None:
+        """Returns the samples to predict for, the prefix first, or None if the full text should be predicted for."""
+        if len(text) <= self.prefix_chars:
+            return None
+        samples = [cut_prefix(text, self.prefix_chars)]
+        if self.sample_lines and (lines := sample_lines(text, self.sample_lines)) is not None:
+            samples.append(cut_prefix(lines, self.prefix_chars))
+        return samples
+
+    def confident(self, predictions: list[dict]) -> bool:
+        """Checks if the predictions for the samples of a text, see samples(), can be kept without the full text."""
+        top1 = {prediction["lang"][0] for prediction in predictions}
+        return len(top1) == 1 and all(prediction["prob"][0] >= self.min_prob for prediction in predictions)
+
+    def count(self, sampled: int, escalated: int) -> None:
+        with self.counts.get_lock():
+            self.counts[0] += sampled
+            self.counts[1] += escalated
+
+    def report(self, name: str) -> None:
+        """Writes the number of texts predicted for on samples and of those escalated to the full text to stderr."""
+        sampled, escalated = self.counts
+        share = escalated / max(sampled, 1)
+        print(f"{name}: {sampled} texts longer than {self.prefix_chars} characters predicted for on samples, "
+              f"{escalated} of them ({share:.1%}) escalated to the full text", file=sys.stderr)
@@ -0,0 +1,119 @@
+"""
+Preprocessing of the texts for the LID models, selected by name for each model identity, see registry.py.
+
+All the entry points predicted with the same preprocessing for an identity, though written differently:
+stage2 replaced newlines before stripping, stage3 and tools/zstdconcat.py stripped first. The order makes no
+difference: str.strip() removes the whitespace at the ends, newlines among it, and newlines are replaced with spaces,
+which are whitespace too, so either order removes the same characters at the ends and leaves the same spaces inside.
+The exception is tools/zstdconcat.py also stripping the texts for the models with the "newlines" preprocessing, e.g.
+of the whitespace at the ends which FastText does not ignore; stage3, which wrote the released LID of these models,
+does not strip them. zstdconcat.py keeps its results with the "newlines_stripped" preprocessing.
+"""
+from __future__ import annotations
+
+import re
+
+import regex
+
+from hplt_textpipes.lid.patterns import NONWORD_REPLACE_PATTERN, SPACE_PATTERN
+
+# the separators joining the texts in preprocess_texts(): a rare space separator for the texts with characters beyond
+# Latin-1 and NUL for the others, which LATIN1_DELETE keeps
+SENTINEL = "\u2007"
+LATIN1_SENTINEL = "\x00"
+LATIN1 = "".join(map(chr, range(256)))
+# preprocess_text() for Latin-1 bytes: the whitespace runs squeezed by SPACE_PATTERN, the table of lower() (no
+# Latin-1 character is lowercased beyond Latin-1) and the characters removed by NONWORD_REPLACE_PATTERN; re is
+# faster than regex for such a simple pattern over bytes
+LATIN1_SPACE_PATTERN = re.compile(
+    b"[" + re.escape("".join(c for c in LATIN1 if SPACE_PATTERN.fullmatch(c * 2))).encode("latin-1") + b"]{2,}")
+LATIN1_LOWER = LATIN1.lower().encode("latin-1")
+LATIN1_DELETE = "".join(c for c in LATIN1 if NONWORD_REPLACE_PATTERN.fullmatch(c) and c != LATIN1_SENTINEL) \
+    .encode("latin-1")
+
+
+def preprocess_text(text: str) -> str:
+    """The openlid preprocessing of a single text, the reference for preprocess_texts()."""
+    if not isinstance(text, str):
+        msg = "Input text must be a string."
+        raise TypeError(msg)
+    return _preprocess_stripped(text.strip())
+
+
+def _preprocess_stripped(text: str) -> str:
+    text = text.replace("\n", " ").lower()
+    text = regex.sub(SPACE_PATTERN, " ", text)
+    return regex.sub(NONWORD_REPLACE_PATTERN, "", text)
+
+
+def _preprocess_latin1(text: bytes) -> str:
+    # lowercasing does not change whitespace, so it can be done after squeezing in one pass with deleting
+    text = LATIN1_SPACE_PATTERN.sub(b" ", text.replace(b"\n", b" "))
+    return text.translate(LATIN1_LOWER, LATIN1_DELETE).decode("latin-1")
+
+
+def preprocess_texts(texts: list[str]) -> list[str]:
+    """
+    The openlid preprocessing of a batch of texts, returns the same as preprocess_text() for each text.
+
+    The stripped texts are joined with a sentinel, so that each pass runs once over the whole batch instead of once
+    per text, the few texts containing the sentinel are preprocessed one by one. The texts encodable in Latin-1 are
+    joined with NUL and processed as bytes: after squeezing whitespace runs with a regex, bytes.translate() lowercases
+    them and deletes the characters removed by NONWORD_REPLACE_PATTERN. The others are joined with a space separator:
+    surrounded by the non-space ends of the stripped texts, it is neither squeezed by SPACE_PATTERN nor removed by
+    NONWORD_REPLACE_PATTERN, and it is neither cased nor case-ignorable, so it ends the context of the final sigma in
+    lower() as the end of a text does.
+    """
+    stripped = []
+    for text in texts:
+        if not isinstance(text, str):
+            msg = "Input text must be a string."
+            raise TypeError(msg)
+        stripped.append(text.strip())
+
+    res = [""] * len(stripped)
+    latin1_ids, latin1, unicode_ids = [], [], []
+    for i, text in enumerate(stripped):
+        if not text:
+            continue
+        try:
+            encoded = text.encode("latin-1")
+        except UnicodeEncodeError:
+            if SENTINEL in text:
+                res[i] = _preprocess_stripped(text)
+            else:
+                unicode_ids.append(i)
+            continue
+        if LATIN1_SENTINEL in text:
+            res[i] = _preprocess_stripped(text)
+        else:
+            latin1_ids.append(i)
+            latin1.append(encoded)
+
+    if latin1_ids:
+        processed = _preprocess_latin1(LATIN1_SENTINEL.encode().join(latin1)).split(LATIN1_SENTINEL)
+        for i, text in zip(latin1_ids, processed):
+            res[i] = text
+    if unicode_ids:
+        processed = _preprocess_stripped(SENTINEL.join(stripped[i] for i in unicode_ids)).split(SENTINEL)
+        for i, text in zip(unicode_ids, processed):
+            res[i] = text
+    return res
+
+
+def replace_newlines(texts: list[str]) -> list[str]:
+    """The newlines preprocessing of a batch of texts: FastText predicts for one line at a time."""
+    return [text.replace("\n", " ") for text in texts]
+
+
+def strip_replace_newlines(texts: list[str]) -> list[str]:
+    """The newlines preprocessing of tools/zstdconcat.py, which also strips the texts."""
+    return [text.strip().replace("\n", " ") for text in texts]
+
+
+# the preprocessing functions by name, each takes a batch of texts and returns them preprocessed in the same order
+PREPROCESSORS = {
+    "openlid": preprocess_texts,
+    "newlines": replace_newlines,
+    "newlines_stripped": strip_replace_newlines,
+}
@@ -0,0 +1,47 @@
+"""
+The LID models known by identity: where their files are found and how the texts are preprocessed for them.
+"""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+# the files of the models not named after their identity; <identity>.bin is tried after them, e.g. openlid-v2.bin, the
+# name under which zstdconcat.py loaded OpenLID v2 before it used the registry
+MODEL_FILES = {
+    "openlid-v2": "openlid_v2_180325.bin",
+}
+
+
+def model_cache_dir() -> str:
+    """The directory of the downloaded models: $HPLT_CACHE, by default ~/.cache/hplt."""
+    return os.environ.get("HPLT_CACHE", os.path.join(Path.home(), ".cache", "hplt"))
+
+
+def model_file(identity: str) -> str:
+    return MODEL_FILES.get(identity, identity + ".bin")
+
+
+def model_files(identity: str) -> list[str]:
+    """The names of the file of the model to look for, in the order of preference."""
+    return list(dict.fromkeys([model_file(identity), identity + ".bin"]))
+
+
+def resolve_model_path(identity: str, model_path: str | None = None, model_dir: str | None = None) -> str | None:
+    """
+    Find the model file for the identity: model_path if it exists, otherwise the files of the identity, see
+    model_files(), in model_dir if given, then in model_cache_dir(). Returns None if none of them exists.
+    """
+    candidates = [model_path] if model_path is not None else []
+    if model_path is None and model_dir is not None:
+        candidates += [os.path.join(model_dir, name) for name in model_files(identity)]
+    candidates += [os.path.join(model_cache_dir(), name) for name in model_files(identity)]
+    return next((path for path in candidates if os.path.isfile(path)), None)
+
+
+def preprocessing_for(identity: str | None) -> str:
+    """
+    The name of the preprocessing of the texts for the model, see PREPROCESSORS: the OpenLID models were trained on
+    texts lowercased without digits and punctuation, the others (e.g. GlotLID) on the texts as they are.
+    """
+    return "openlid" if identity is None or "openlid" in identity else "newlines"
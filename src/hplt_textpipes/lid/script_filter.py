@@ -0,0 +1,85 @@
+"""
+Short-circuit of LID for the texts written in a script which only one label of the model uses, e.g. Georgian or
+Armenian: the script alone settles the top-1 label, so the model is not run for them.
+"""
+from __future__ import annotations
+
+import multiprocessing
+import sys
+from collections import defaultdict
+
+import regex
+
+
+def label_script(label: str) -> str | None:
+    """Returns the ISO 15924 code of the script of a label like __label__kat_Geor, or None if it has no script."""
+    _, sep, script = label.removeprefix("__label__").rpartition("_")
+    return script if sep and len(script) == 4 else None
+
+
+class ScriptShortCircuit:
+    """
+    Predicts the label of a text without the model if at least min_share of its letters are in a script used by only
+    one label of the model, and the first letter is in this script. The scripts come from the labels of the model,
+    those unknown to Unicode (e.g. Jpan or Hans, which are combinations of scripts) are never short-circuited.
+    The result is the label with the nominal probability 1.0, it has the same top-1 label as the model whenever the
+    model would agree with the script, see verify. Unlike the top-3 labels with calibrated probabilities predicted by
+    the model, it has a single label and is marked with "shortcut": true, so that thresholds on the probabilities can
+    tell such results apart.
+
+    :param labels: the labels of the model, e.g. fasttext.FastText.get_labels()
+    :param min_share: the minimal share of the letters of the text in the script
+    :param verify: still run the model for the short-circuited texts and return its results, counting the texts for
+    which its top-1 label differs from the one settled by the script
+    :param counts: the counters of checked, short-circuited and disagreeing texts, pass the counts of another instance
+    to share them between processes
+    """
+    def __init__(self, labels: list[str], min_share: float = 0.99, verify: bool = False, counts=None) -> None:
+        script2labels = defaultdict(list)
+        for label in labels:
+            script2labels[label_script(label)].append(label.removeprefix("__label__"))
+        self.script2label = {}
+        for script, script_labels in script2labels.items():
+            if script is None or len(script_labels) != 1:
+                continue
+            try:
+                regex.compile(rf"\p{{sc={script}}}")
+            except regex.error:
+                continue
+            self.script2label[script] = script_labels[0]
+        self.scripts = list(self.script2label)
+        # the group of the script of the first letter, no group for the other scripts
+        self.first_letter = regex.compile("|".join([rf"(\p{{sc={s}}})" for s in self.scripts] + [r"\p{L}"]))
+        self.foreign = {s: regex.compile(rf"[\p{{L}}--\p{{sc={s}}}]+", flags=regex.V1) for s in self.scripts}
+        self.nonletters = regex.compile(r"\P{L}+")
+        self.min_share = min_share
+        self.verify = verify
+        self.counts = multiprocessing.Array("q", 3) if counts is None else counts
+
+    def label(self, text: str) -> str | None:
+        """Returns the label settled by the script of the text, or None if the model should be run."""
+        if not self.scripts or (m := self.first_letter.search(text)) is None or m.lastindex is None:
+            return None
+        script = self.scripts[m.lastindex - 1]
+        foreign = self.foreign[script]
+        if foreign.search(text) is not None:
+            nforeign = len(text) - len(foreign.sub("", text))
+            nletters = len(self.nonletters.sub("", text))
+            if nforeign > (1 - self.min_share) * nletters:
+                return None
+        return self.script2label[script]
+
+    def count(self, checked: int, short_circuited: int, disagreements: int = 0) -> None:
+        with self.counts.get_lock():
+            self.counts[0] += checked
+            self.counts[1] += short_circuited
+            self.counts[2] += disagreements
+
+    def report(self, name: str) -> None:
+        """Writes the number of short-circuited texts to stderr, and in the verify mode the number of disagreements."""
+        checked, short_circuited, disagreements = self.counts
+        share = short_circuited / max(checked, 1)
+        msg = f"{name}: script short-circuit for {short_circuited}/{checked} texts ({share:.1%})"
+        if self.verify:
+            msg += f", the model disagreed on the top-1 label for {disagreements} of them"
+        print(msg, file=sys.stderr)
@@ -4,19 +4,19 @@ from __future__ import annotations
 
 import argparse
 import fileinput
+import itertools
 import logging
+import sys
 
-import fasttext
-import numpy
-import regex
 import ujson
-import os
 
+from hplt_textpipes.lid.engine import LidEngine
+from hplt_textpipes.lid.registry import resolve_model_path
 from hplt_textpipes.stage2.fastertext_lid.basic_log import langid_logger
-from hplt_textpipes.stage2.fastertext_lid.patterns import NONWORD_REPLACE_PATTERN, SPACE_PATTERN
+from hplt_textpipes.utils.jsonl_writer import JsonlWriter
 
 
-class FastTextLangId:
+class FastTextLangId(LidEngine):
     """The FastText language identification model."""
 
     def __init__(
@@ -25,6 +25,8 @@ class FastTextLangId:
         *,
         use_logging: bool = False,
         level_log: int | None = logging.INFO,
+        identity: str = "openlid-v2",
+        **options,
     ) -> None:
         """
         Init the FastText model.
@@ -35,6 +37,7 @@ class FastTextLangId:
         Expected usage (stdin jsonlines):
         python -m src.hplt_textpipes.stage2.fastertext_lid.proto_langid --model_path $MODEL_PATH < $YOUR_FILE
 
+        The options of the prediction are those of LidEngine.
         """
         if use_logging is True:
             self.logger = langid_logger(name="basic_langid_logger", level=level_log)
@@ -42,43 +45,13 @@ class FastTextLangId:
             self.logger = logging.getLogger(name="basic_langid_logger_disabled")
             self.logger.disabled = True
 
-        self.model = fasttext.load_model(model_path)
+        super().__init__(model_path, identity, **options)
         self.logger.debug("FastTextLangId model loaded.")
 
-    def _preproccess_text(self, text: str) -> str:
-        """Preprocesses a single line of text for lang ID."""
-        if not isinstance(text, str):
-            msg = "Input text must be a string."
-            raise TypeError(msg)
-
-        self.logger.debug("Before: %s", text)
-        text = text.replace('\n', ' ').strip().lower()
-        text = regex.sub(SPACE_PATTERN, " ", text)
-        text = regex.sub(NONWORD_REPLACE_PATTERN, "", text)
-        self.logger.debug("After: %s", text)
-        return text
-
-    def _postprocess_predicted_labels(self, prediction: tuple) -> list[str]:
-        """
-        Postprocess the predicted labels.
-
-        Example: "__label__eng_Latn" -> "eng_Latn"
-        """
-        return [label.replace("__label__", "") for label in prediction[0]]
-
-    def _postprocess_predicted_probabilities(self, prediction: tuple) -> list[float]:
-        """
-        Postprocess the predicted probabilities.
-
-        Example: [0.92134414] -> [0.9213]
+    def predict_language_from_stdin_jsonlines(self, batch_size: int = 1) -> None:
         """
-        rounded_probs = numpy.round(prediction[1], decimals=4)
-
-        return rounded_probs.tolist()
-
-    def predict_language_from_stdin_jsonlines(self) -> None:
-        """
-        Read from stdin jsonlines.
+        Read from stdin jsonlines. If batch_size is more than 1, predicts for this many lines at once with
+        predict_batch().
 
         Example input:
 
@@ -89,40 +62,19 @@ class FastTextLangId:
         {"lang": ["eng_Latn"], "prob": [0.9213]}
 
         """
-        with fileinput.input(files=("-",), encoding="utf-8") as f:
+        with fileinput.input(files=("-",), encoding="utf-8") as f, JsonlWriter() as writer:
+            if batch_size > 1:
+                while batch := list(itertools.islice(f, batch_size)):
+                    for result in self.predict_batch([ujson.loads(line)["t"] for line in batch]):
+                        writer.write(result)
+                return None
+
             for fileinput_line in f:
                 self.logger.debug("Read fileinput line: %s", fileinput_line)
                 # load json line
                 json_line = ujson.loads(fileinput_line)
                 self.logger.debug("Read json line.")
-
-                if json_line["t"] is None:
-                    self.logger.debug("Case: text is None.")
-                    print(ujson.dumps({"lang": None}))
-
-                elif len(json_line["t"]) == 0:
-                    self.logger.debug("Case: text is empty.")
-                    print(ujson.dumps({"lang": None}))
-
-                else:
-                    self.logger.debug("Case: text is ok.")
-                    prediction = self.model.predict(
-                        text=self._preproccess_text(json_line["t"]),
-                        k=3,
-                        threshold=0.0,
-                        on_unicode_error="strict",
-                    )
-
-                    print(
-                        ujson.dumps(
-                            {
-                                "lang": self._postprocess_predicted_labels(prediction),
-                                "prob": self._postprocess_predicted_probabilities(
-                                    prediction
-                                ),
-                            }
-                        )
-                    )
+                writer.write(self.predict_text(json_line["t"]))
 
         return None
 
@@ -134,8 +86,15 @@ if __name__ == "__main__":
     parser.add_argument(
         "--model_path",
         type=str,
-        default=os.path.join(os.path.expanduser("~"), ".cache/hplt/openlid_v2_180325.bin"),
-        help="Path to the FastText model file.",
+        default=None,
+        help="Path to the FastText model file, by default openlid_v2_180325.bin in $HPLT_CACHE or ~/.cache/hplt.",
+    )
+
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1000,
+        help="Number of lines to predict for at once, 1 predicts for each line separately.",
     )
 
     parser.add_argument(
@@ -154,11 +113,14 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
+    model_path = resolve_model_path("openlid-v2", args.model_path)
+    if model_path is None:
+        sys.exit(f"proto_langid.py: missing model file {args.model_path or 'for openlid-v2'}")
 
     loaded_model = FastTextLangId(
-        model_path=args.model_path,
+        model_path=model_path,
         use_logging=args.use_logging,
         level_log=logging.getLevelName(args.log_level),
     )
 
-    loaded_model.predict_language_from_stdin_jsonlines()
+    loaded_model.predict_language_from_stdin_jsonlines(args.batch_size)
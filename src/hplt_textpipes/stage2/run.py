@@ -0,0 +1,231 @@
+import io
+import os
+import sys
+import multiprocessing
+from collections import deque, Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from timeit import default_timer as timer
+from functools import partial
+
+import fire
+import orjson
+import ujson
+import zstandard
+
+from hplt_textpipes.stage2.trafilatura.traf import traf_pool, open_cache, SplitWriter
+from hplt_textpipes.stage2.tagfilter.prescreen import TagFilterPrescreen
+from hplt_textpipes.stage2.tagfilter.tagfilter2 import TagFilterStats
+from hplt_textpipes.stage2.fastertext_lid.proto_langid import FastTextLangId
+from hplt_textpipes.lid.registry import resolve_model_path
+from hplt_textpipes.utils.jsonl_writer import JsonlWriter, dumps_line
+from hplt_textpipes.utils.memory_usage import report_memory
+
+# the model of the LID workers, see _load_lid_model()
+_lid_model = None
+
+
+def _load_lid_model(model_path, identity):
+    # loaded in the parent process before forking the LID workers, so that they share its pages instead of loading
+    # a private copy each
+    global _lid_model
+    _lid_model = FastTextLangId(model_path, identity=identity)
+
+
+def _loads(outline):
+    try:
+        return orjson.loads(outline)
+    except orjson.JSONDecodeError:
+        return ujson.loads(outline)  # lone surrogates escaped in texts are rejected by orjson
+
+
+def _lid_batch(outlines):
+    st = timer()
+    langs = _lid_model.predict_batch([_loads(outline)['t'] for outline in outlines])
+    langlines = [dumps_line(lang) for lang in langs]
+    return langlines, timer() - st
+
+
+class TimedReader:
+    """Iterates over the lines of a binary stream measuring the time spent reading (and decompressing) them."""
+    def __init__(self, stream, stats):
+        self.stream, self.stats = stream, stats
+
+    def __iter__(self):
+        while True:
+            st = timer()
+            line = self.stream.readline()
+            self.stats['seconds'] += timer() - st
+            if not line:
+                return
+            self.stats['docs'] += 1
+            self.stats['bytes'] += len(line)
+            yield line
+
+
+class TimedWriter:
+    """Passes the lines to writer measuring the time spent writing (and compressing) them."""
+    def __init__(self, writer, stats):
+        self.writer, self.stats = writer, stats
+
+    def write_line(self, line):
+        st = timer()
+        self.writer.write_line(line)
+        self.stats['seconds'] += timer() - st
+        self.stats['docs'] += 1
+        self.stats['bytes'] += len(line)
+
+
+class TextLidWriter:
+    """
+    Receives the output lines of traf.py in the order of the input documents, writes them to text_writer and sends them
+    in batches to the pool of LID workers, writes their outputs to lang_writer in the same order. At most max_pending
+    batches are sent to the LID workers without collecting their results, see ordered_imap().
+    """
+    def __init__(self, text_writer, lang_writer, lid_pool, batch_size, max_pending, stats):
+        self.text_writer, self.lang_writer = text_writer, lang_writer
+        self.submit = partial(lid_pool.submit, _lid_batch)
+        self.batch_size, self.max_pending = batch_size, max_pending
+        self.stats = stats
+        self.batch = []
+        self.pending = deque()
+
+    def write_line(self, outline):
+        self.text_writer.write_line(outline)
+        self.batch.append(outline)
+        if len(self.batch) == self.batch_size:
+            self._submit()
+        while self.pending and (self.pending[0].done() or len(self.pending) > self.max_pending):
+            self._write_lang(self.pending.popleft().result())
+
+    def _submit(self):
+        if self.batch:
+            self.stats['lid']['bytes'] += sum(len(outline) for outline in self.batch)
+            self.pending.append(self.submit(self.batch))
+            self.batch = []
+
+    def _write_lang(self, res):
+        langlines, lid_seconds = res
+        for langline in langlines:
+            self.lang_writer.write_line(langline)
+        self.stats['lid']['seconds'] += lid_seconds
+        self.stats['lid']['docs'] += len(langlines)
+
+    def close(self):
+        self._submit()
+        while self.pending:
+            self._write_lang(self.pending.popleft().result())
+
+
+def report(stats, wall):
+    """
+    Prints to stderr the throughput of each stage. Time for the stages running in the main process (reading and
+    decompressing the input, compressing the outputs) is the time spent there, for LID it is the total time of the
+    workers; Trafilatura keeps the rest of the workers busy for the whole wall time. LID fused into the Trafilatura
+    workers is not reported separately.
+    """
+    print(f'run.py: total {wall:.1f}s, {stats["read"]["docs"] / wall:.1f} docs/s', file=sys.stderr)
+    for stage in ('read', 'traf', 'text', 'lid', 'lang'):
+        s = stats[stage]
+        if not s['docs']:
+            continue
+        seconds = wall if stage == 'traf' else s['seconds']
+        print(f'run.py: {stage}\tdocs={s["docs"]}\tMB={s["bytes"] / 2**20:.1f}\tseconds={seconds:.1f}\t'
+              f'docs/s={s["docs"] / max(seconds, 1e-9):.1f}\tMB/s={s["bytes"] / 2**20 / max(seconds, 1e-9):.1f}',
+              file=sys.stderr)
+
+
+def main(fin: str, outdir: str, njobs: int = None, lid_njobs: int = None, batch_size: int = 100,
+         lid_batch_size: int = 1000, timelimit_perdoc: float = 10, decoding_errors: str = 'ignore',
+         timeout_engine: str = 'signal', lid_model: str = None, zstd_level: int = 3, zstd_threads: int = 4,
+         cache_path: str = None, cache_max_mb: int = 10240, fuse_lid: bool = False, tagfilter_prescreen: bool = False,
+         tagfilter_stats: str = None, lid_identity: str = 'openlid-v2'):
+    """
+    Runs stage2 for one html.zst file in a single process: decompresses the input, extracts texts with Trafilatura in
+    a pool of workers (see traf.py), identifies languages of the texts in another pool of workers (see proto_langid.py),
+    writes text.zst and lang.zst to outdir compressing them with multithreaded zstd. This replaces the pipeline of
+    zstdcat, GNU parallel, tee and zstd, which spent several cores on copying data through pipes.
+    Prints the throughput of each stage to stderr.
+
+    :param fin: path to the input html.zst or '-' to read it (compressed) from stdin, e.g. from rclone cat; pass it as
+    --fin=- since fire does not accept '-' as a positional argument
+    :param outdir: the directory for text.zst and lang.zst
+    :param njobs: the total number of worker processes, the number of CPUs minus 2 by default
+    :param lid_njobs: how many of the workers run LID, 10% by default; the rest run Trafilatura; ignored with fuse_lid
+    :param batch_size: number of documents sent to a Trafilatura worker at once
+    :param lid_batch_size: number of texts sent to a LID worker at once
+    :param timelimit_perdoc: see traf.py
+    :param decoding_errors: see traf.py
+    :param timeout_engine: see traf.py
+    :param lid_model: path to the FastText model, by default the model of lid_identity in $HPLT_CACHE or ~/.cache/hplt
+    :param zstd_level: compression level for the outputs
+    :param zstd_threads: number of threads compressing each of the outputs
+    :param cache_path: see traf.py
+    :param cache_max_mb: see traf.py
+    :param fuse_lid: run LID in the Trafilatura workers on the texts they have just extracted, see traf.output_lines();
+    this saves serializing and parsing the texts again and tuning the split of workers between the two steps
+    :param tagfilter_prescreen: see traf.py
+    :param tagfilter_stats: see traf.py
+    :param lid_identity: see traf.py
+    """
+    model_path = resolve_model_path(lid_identity, lid_model)
+    if model_path is None:
+        sys.exit(f"run.py: missing model file {lid_model or 'for ' + lid_identity}")
+    lid_model = model_path
+    njobs = njobs or max(2, os.cpu_count() - 2)
+    if fuse_lid:
+        lid_njobs, traf_njobs = 0, njobs
+        print(f'Running trafilatura and lid in {traf_njobs} processes', file=sys.stderr)
+    else:
+        lid_njobs = lid_njobs or njobs // 10 + 1
+        traf_njobs = max(1, njobs - lid_njobs)
+        print(f'Running lid in {lid_njobs} and trafilatura in {traf_njobs} processes', file=sys.stderr)
+    os.makedirs(outdir, exist_ok=True)
+
+    stats = {stage: Counter() for stage in ('read', 'traf', 'text', 'lid', 'lang')}
+    st = timer()
+    with ExitStack() as stack:
+        def open_output(fname):
+            # a compressor cannot be shared by simultaneous streams
+            cctx = zstandard.ZstdCompressor(level=zstd_level, threads=zstd_threads)
+            stream = stack.enter_context(zstandard.open(os.path.join(outdir, fname), 'wb', cctx=cctx))
+            return stack.enter_context(JsonlWriter(stream))
+
+        inp = stack.enter_context(io.BufferedReader(zstandard.open(sys.stdin.buffer if fin == '-' else fin, 'rb')))
+        text_writer = TimedWriter(open_output('text.zst'), stats['text'])
+        lang_writer = TimedWriter(open_output('lang.zst'), stats['lang'])
+        fused_lid_model = lid_model if fuse_lid else None
+        cache = stack.enter_context(open_cache(cache_path, cache_max_mb, single_pass=False,
+                                                   lid_model=fused_lid_model, lid_identity=lid_identity, decoding_errors=decoding_errors)) \
+            if cache_path else None
+
+        if fuse_lid:
+            writer = SplitWriter(text_writer, lang_writer)
+        else:
+            _load_lid_model(lid_model, lid_identity)
+            # a killed LID worker fails the pending batches with BrokenProcessPool instead of hanging, as in traf.py
+            lid_pool = stack.enter_context(ProcessPoolExecutor(lid_njobs,
+                                                               mp_context=multiprocessing.get_context('fork')))
+            writer = TextLidWriter(text_writer, lang_writer, lid_pool, lid_batch_size, 2 * lid_njobs, stats)
+        prescreen = TagFilterPrescreen() if tagfilter_prescreen else None
+        tf_stats = TagFilterStats() if tagfilter_stats else None
+        traf_pool(TimedReader(inp, stats['read']), traf_njobs, batch_size, timeout_engine, cache=cache, writer=writer,
+                  lid_model=fused_lid_model, lid_identity=lid_identity, prescreen=prescreen, tagfilter_stats=tf_stats,
+                  decoding_errors=decoding_errors, timelimit_perdoc=timelimit_perdoc)
+        if not fuse_lid:
+            writer.close()  # waits for the remaining LID batches
+        stats['traf']['docs'] = stats['text']['docs']
+        stats['traf']['bytes'] = stats['read']['bytes']
+        if cache is not None:
+            cache.report('run.py')
+        if prescreen is not None:
+            prescreen.report('run.py')
+        if tf_stats is not None:
+            tf_stats.dump(tagfilter_stats)
+        if not fuse_lid:
+            report_memory('run.py')
+    report(stats, timer() - st)
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -36,38 +36,31 @@ stream_html() {
 
   # rclone occasionally crashes with EOF error when streaming some files from lumio (<1% for bs=10, ~50% for bs=1000)...
   # s3cmd shows warnings about EOF for these files, but retries with success
+  # the stream is left compressed, it is decompressed by the python process
   if [[ $FIN =~ ^lumio: ]]; then
     S3FIN=`echo $FIN | sed 's@lumio:@s3://@'`
     echo "Streaming $S3FIN of size $size GB using s3cmd"  1>&2
-    s3cmd get $S3FIN - | zstdcat
+    s3cmd get $S3FIN -
   else
     echo "Streaming $FIN of size $size GB using rclone"  1>&2
-    rclone cat $FIN | zstdcat
+    rclone cat $FIN
   fi
 }
 
 process_html() {
   NJOBS=`nproc --all`
-  BLOCKSIZE_TRAF=30M  #  more parallel processes than for lid require smaller blocks;
+  BATCHSIZE_TRAF=100  # documents sent to a trafilatura worker at once
   TRAF_TIMEOUT=10  # timeout 10s, increased from 0.5s to compensate for adding xml extraction for the 3rd iteration and hopefully get more long good texts
-  BLOCKSIZE_LID=100M  # 0.3s-0.5s to load model, 4.4s to FastText.predict for 10k lines, 28 MB (not random sample!)
+  ZSTD_THREADS=2  # compression threads for each of text.zst and lang.zst
 
-  NJOBS=$(($NJOBS - 8))  # leave some threads for rclone, zstdcat, zstd steps in the pipeline
-  NJOBS_LID=$(($NJOBS/10 + 1))
-  NJOBS_TRAF=$(($NJOBS - $NJOBS_LID))
-
-  # --keep-order guarantees that GNU Parallel will collect stdout from tasks and print it to its stdout in the order
-  # aligned with the order of input lines
-  # --block issues one task per block of input lines of roughly this size, but without breaking lines;
-  # making it too small will increase extra costs on script initialization (e.g. weights loading for langid),
-  # making it too large will require buffering too much outputs in parallel due to --keep-order requirement.
-  echo Running lid in $NJOBS_LID and trafilatura in $NJOBS_TRAF processes
+  NJOBS=$(($NJOBS - 2))  # leave some threads for rclone and the main python process
 
+  # Decompression, trafilatura, lid and compression of the outputs run in one python process with a pool of workers
+  # running both trafilatura and lid on the extracted texts; it keeps the order of outputs aligned with the order of
+  # input lines itself.
   stream_html \
-      | parallel --halt now,fail=1 --block $BLOCKSIZE_TRAF -j $NJOBS_TRAF --pipe --keep-order  \
-          "python -m hplt_textpipes.stage2.trafilatura.traf --timelimit_perdoc ${TRAF_TIMEOUT}" | tee >(zstd > ${OUTDIR}/text.zst) \
-      | parallel --halt now,fail=1 --block $BLOCKSIZE_LID -j $NJOBS_LID --pipe --keep-order \
-          "python -m hplt_textpipes.stage2.fastertext_lid.proto_langid" | zstd > ${OUTDIR}/lang.zst
+      | python -m hplt_textpipes.stage2.run --fin=- --outdir ${OUTDIR} --njobs $NJOBS --fuse_lid \
+          --timelimit_perdoc ${TRAF_TIMEOUT} --batch_size $BATCHSIZE_TRAF --zstd_threads $ZSTD_THREADS
 }
 
 time prepare_inputs
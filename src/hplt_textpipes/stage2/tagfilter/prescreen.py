@@ -0,0 +1,136 @@
+import re
+import sys
+from collections import Counter
+from functools import cache
+from html.entities import html5
+
+from hplt_textpipes.stage2.tagfilter.tagfilter1 import load_tagfilters
+from hplt_textpipes.stage2.tagfilter.tagfilter2 import literal_prefix
+from hplt_textpipes.utils.shared_counters import SharedCounters
+
+# characters escaped by JSON writers without \u, these may split a literal in the raw line
+JSON_SHORT_ESCAPED = set('"\\/\b\f\n\r\t')
+MIN_ANCHOR_LEN = 4
+
+
+def select_anchors(literals):
+    """
+    Greedily selects a few substrings such that each literal contains at least one of them, preferring the substrings
+    shared by more literals, then the longer ones. Literals shorter than MIN_ANCHOR_LEN are anchors themselves.
+    """
+    uncovered, anchors = set(literals), []
+    while uncovered:
+        cnt = Counter()
+        for l in uncovered:
+            n = min(len(l), MIN_ANCHOR_LEN)
+            cnt.update({l[i:j] for i in range(len(l)) for j in range(i + n, len(l) + 1)})
+        anchor = max(cnt, key=lambda s: (cnt[s], len(s)))
+        anchors.append(anchor)
+        uncovered = {l for l in uncovered if anchor not in l}
+    return anchors
+
+
+def numeric_refs(chars):
+    """Returns a regex matching numeric character references to any of the characters."""
+    codes = {ord(c) for c in chars}
+    # HTML parsers replace references to C1 controls with windows-1252 characters
+    codes.update(code for code in range(0x80, 0xa0) if not chars.isdisjoint(bytes([code]).decode('cp1252', 'ignore')))
+    dec = '|'.join(str(code) for code in sorted(codes))
+    hexa = '|'.join(f'{code:x}' for code in sorted(codes))
+    # the parsers take all digits following &#, so the code should not be followed by another digit
+    return f'&#(?:0*(?:{dec})(?![0-9])|[xX]0*(?i:{hexa})(?![0-9a-fA-F]))'
+
+
+@cache
+def _build_tables():
+    """
+    Builds the tables of TagFilterPrescreen once per process, the pool workers forked after the prescreen is created in
+    the parent process inherit them.
+    """
+    keys, anchors = [], set()
+    for (tag, attr), patterns in load_tagfilters().items():
+        literals = [literal_prefix(p).lower() for p in patterns]
+        if any(not l or not l.isascii() or JSON_SHORT_ESCAPED & set(l) for l in literals):
+            literals = None
+            anchors.add(max(tag, attr, key=len).lower())
+        else:
+            anchors.update(literals)
+        keys.append((f'<{tag}'.lower().encode(), attr.lower().encode(),
+                     None if literals is None else sorted({l.encode() for l in literals})))
+
+    ascii_chars = set(''.join(l.decode() for _, _, literals in keys if literals for l in literals))
+    # the characters matching those of the literals with re.IGNORECASE, e.g. the Kelvin sign matches k; there are
+    # no such characters outside of the BMP
+    bmp = ''.join(map(chr, range(0x10000)))
+    chars = set(re.findall(f'[{re.escape("".join(ascii_chars))}]', bmp, flags=re.IGNORECASE)) if ascii_chars \
+        else set()
+    non_ascii = sorted(c for c in chars if not c.isascii())
+    non_ascii_lead = sorted({c.encode()[:1] for c in non_ascii})
+    non_ascii_re = re.compile('|'.join(re.escape(c) for c in non_ascii).encode()) if non_ascii else None
+    names = sorted({name.rstrip(';') for name, val in html5.items() if not chars.isdisjoint(val)},
+                   key=lambda name: (-len(name), name))
+    refs = re.compile('|'.join([numeric_refs(chars)] + [f'&{name}' for name in names]).encode()) if chars else None
+    escaped = sorted({f'{ord(c):04x}' for c in non_ascii} | {f'{code:04x}' for code in range(0x20, 0x7f)})
+    json_escape = re.compile(rb'\\u(?i:' + '|'.join(escaped).encode() + rb')')
+    return keys, [a.encode() for a in select_anchors(anchors)], non_ascii_lead, non_ascii_re, refs, json_escape
+
+
+class TagFilterPrescreen:
+    """
+    Checks the raw input line before parsing JSON and HTML if any tag filter may match the document: for some (tag, attr)
+    in the filter list the line should contain '<tag', the attribute name and the literal prefix of any of its patterns
+    (see literal_prefix()), ignoring ASCII case. Otherwise the DOM-based matching can be skipped, as it would return
+    None. Most lines are rejected after searching for a few anchors, substrings of all the literals and of the
+    attribute names for the patterns without literals, see select_anchors().
+    There are no false negatives: element and attribute names cannot be escaped in HTML, and attribute values are
+    substrings of the line unless they contain escapes, so the lines with any of the following always pass:
+    JSON escapes of printable ASCII characters or of the non-ASCII characters which the patterns match ignoring case,
+    e.g. the dotless i (usual JSON writers escape only control and non-ASCII characters), the latter in UTF-8,
+    numeric or named character references to the characters of the literals or their equivalents ignoring case.
+    Lines which are not valid UTF-8 should not be passed here, since dropping invalid bytes may join parts of a literal.
+    Patterns without a literal prefix (e.g. $^) or with a literal which may be escaped in JSON are assumed to match
+    any value.
+
+    :param counts: the counters of checked and skipped documents, pass the counts of another instance to share them
+    between processes; each process counts without a lock in the slot claimed when creating the instance, see
+    SharedCounters
+    """
+    def __init__(self, counts=None):
+        self.keys, self.anchors, self.non_ascii_lead, self.non_ascii, self.refs, self.json_escape = _build_tables()
+        self.counts = SharedCounters('q', 2) if counts is None else counts
+        self.counts.claim()
+
+    def _escaped(self, byteline):
+        if self.json_escape.search(byteline):
+            return True
+        if self.non_ascii is not None and any(b in byteline for b in self.non_ascii_lead) \
+                and self.non_ascii.search(byteline):
+            return True
+        return self.refs is not None and b'&' in byteline and self.refs.search(byteline) is not None
+
+    def _may_match(self, byteline):
+        if self._escaped(byteline):
+            return True
+        lowered = byteline.lower()
+        if not any(a in lowered for a in self.anchors):
+            return False
+        for tag, attr, literals in self.keys:
+            if tag in lowered and attr in lowered and (literals is None or any(l in lowered for l in literals)):
+                return True
+        return False
+
+    def may_match(self, byteline):
+        """
+        Returns False if no tag filter matches the document in the input line (valid UTF-8), True if some may match.
+        """
+        res = self._may_match(byteline)
+        self.counts.add(0)
+        if not res:
+            self.counts.add(1)
+        return res
+
+    def report(self, name):
+        """Writes the skip rate to stderr."""
+        checked, skipped = self.counts.totals()
+        print(f'{name}: tag filter prescreen skipped {skipped}/{checked} documents ({skipped / max(checked, 1):.1%})',
+              file=sys.stderr)
@@ -3,6 +3,8 @@
 from collections import defaultdict
 import re
 
+from lxml import etree
+
 TARGET_LANG_ATTRS = ('http-equiv="content-language"', 'property="og:locale"')
 RE_HTML_LANG = re.compile(r'([a-z]{2})')
 
@@ -18,3 +20,85 @@ def extract_lang_info(tree):
         res['htmllang'].extend(elem.get("lang", "") for elem in elems)
 
     return res
+
+
+class MetadataField:
+    """
+    A field extracted by DocumentMetadataExtractor: the list of values for the elements with the tag satisfying the
+    XPath condition, in document order. value(element) should return None for the elements not satisfying the
+    condition, since all the elements selected for the fields with the same tag are passed to it.
+    The elements are searched for in the tree of the root element passed to extract(), or in the whole document if
+    absolute, which also includes the elements that libxml2 keeps as extra top-level roots, e.g. a second <html> after
+    </html>.
+    """
+    def __init__(self, name, tag, condition, value, absolute=False):
+        self.name, self.tag, self.condition, self.value = name, tag, condition, value
+        self.absolute = absolute
+
+    def xpath(self):
+        axis = '//' if self.absolute else 'descendant-or-self::'
+        return f'{axis}{self.tag}[{self.condition}]'
+
+
+def _meta_content(attr, val):
+    return lambda e: e.get('content') if e.get(attr) == val else None
+
+
+# the fields of extract_lang_info() in the same order
+LANG_FIELDS = (
+    MetadataField('metalang', 'meta', '@http-equiv="content-language" and @content',
+                  _meta_content('http-equiv', 'content-language')),
+    MetadataField('metalang', 'meta', '@property="og:locale" and @content', _meta_content('property', 'og:locale')),
+    MetadataField('htmllang', 'html', '@lang', lambda e: e.get('lang'), absolute=True),
+)
+# optional fields
+EXTRA_FIELDS = {
+    'title': MetadataField('title', 'title', 'true()', lambda e: e.text or ''),
+    'canonical': MetadataField('canonical', 'link', '@rel="canonical" and @href',
+                               lambda e: e.get('href') if e.get('rel') == 'canonical' else None),
+    'og': MetadataField('og', 'meta', 'starts-with(@property, "og:") and @content',
+                        lambda e: [e.get('property'), e.get('content')]
+                        if e.get('property', '').startswith('og:') and e.get('content') is not None else None),
+}
+
+
+class DocumentMetadataExtractor:
+    """
+    Extracts the match of the tag filters (see TagFilter2), the language info (see extract_lang_info()) and optionally
+    other fields (see EXTRA_FIELDS) with one pre-compiled XPath expression, the union of the expressions selecting the
+    elements for each of them, which libxml2 returns in document order. Each element is dispatched to the tag filters
+    and the fields for its tag. Returns the same as TagFilter2.matches() in the 'tagfilter' field if it is not None and
+    the same as extract_lang_info(), fields without values are not returned.
+
+    :param tagfilter: TagFilter2 or None to skip matching the tag filters
+    :param extra_fields: names of the fields in EXTRA_FIELDS or MetadataField instances, returned after the language
+    info in this order
+    """
+    def __init__(self, tagfilter=None, extra_fields=()):
+        self.tagfilter = tagfilter
+        self.fields = LANG_FIELDS + tuple(EXTRA_FIELDS[f] if isinstance(f, str) else f for f in extra_fields)
+        self.names = list(dict.fromkeys(f.name for f in self.fields))
+        self.tag2fields = {}
+        for i, f in enumerate(self.fields):
+            self.tag2fields.setdefault(f.tag, []).append((i, f))
+        branches = [f.xpath() for f in self.fields]
+        self.select = etree.XPath(' | '.join(branches))
+        self.select_all = etree.XPath(' | '.join(branches + tagfilter.xpath_branches())) \
+            if tagfilter is not None else self.select
+
+    def extract(self, tree, match_tagfilters=True):
+        match_tagfilters = match_tagfilters and self.tagfilter is not None
+        best, tagmatch = self.tagfilter.nkeys if match_tagfilters else 0, None
+        values = [[] for _ in self.fields]
+        for e in (self.select_all if match_tagfilters else self.select)(tree):
+            if best > 0 and (m := self.tagfilter.match_element(e, best)) is not None:
+                best, tagmatch = m
+            for i, f in self.tag2fields.get(e.tag, ()):
+                if (val := f.value(e)) is not None:
+                    values[i].append(val)
+
+        res = {} if tagmatch is None else {'tagfilter': tagmatch}
+        for f, vals in zip(self.fields, values):
+            if vals:
+                res.setdefault(f.name, []).extend(vals)
+        return res
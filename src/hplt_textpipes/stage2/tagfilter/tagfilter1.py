@@ -1,21 +1,34 @@
 import re
 from collections import defaultdict
+from functools import cache
 from pathlib import Path
 from importlib.resources import files
 
 
-def load_tagfilters(tagfilters_fname="mt-filter-list.annotated"):
+@cache
+def _read_tagfilters(tagfilters_fname):
     # For Python<3.10 replace importlib.resources with importlib_resources,
     # see https://setuptools.pypa.io/en/latest/userguide/datafiles.html for details
     filters_text = files('hplt_textpipes.stage2.tagfilter').joinpath(tagfilters_fname).read_text()
 
-    tagfilters = defaultdict(list)
+    rules = []
     for l in filters_text.split('\n'):
         l = l.strip()
         if l == '' or l.startswith('#'):
             continue
         ff = l.split('\t')
-        tagfilters[tuple(ff[:2])].append(ff[-1])
+        rules.append((tuple(ff[:2]), ff[-1]))
+    return tuple(rules)
+
+
+def load_tagfilters(tagfilters_fname="mt-filter-list.annotated"):
+    """
+    Returns the patterns for each (tag, attr) in the order of the filter list. The file is read once per process,
+    the matchers, the prescreen and the cache namespace all load it.
+    """
+    tagfilters = defaultdict(list)
+    for k, pattern in _read_tagfilters(tagfilters_fname):
+        tagfilters[k].append(pattern)
     return tagfilters
 
 
@@ -0,0 +1,206 @@
+import json
+import re
+from collections import defaultdict
+from timeit import default_timer as timer
+
+from lxml import etree
+
+from hplt_textpipes.stage2.tagfilter.tagfilter1 import load_tagfilters
+from hplt_textpipes.utils.shared_counters import SharedCounters
+
+try:
+    import ahocorasick  # pyahocorasick, optional, install hplt-textpipes[automaton] for the automaton backend
+except ImportError:
+    ahocorasick = None
+
+BACKENDS = ('re', 'automaton')
+REGEX_METACHARS = set('.^$*+?{}[]\\|()')
+
+
+def literal_prefix(pattern):
+    """
+    Returns the longest literal string that every match of the regex pattern starts with, or '' if the pattern may
+    not start with a literal, e.g. it has alternatives.
+    """
+    if '|' in pattern:
+        return ''
+    i = 0
+    while i < len(pattern) and pattern[i] not in REGEX_METACHARS:
+        i += 1
+    if i < len(pattern) and pattern[i] in '*?{':
+        i -= 1  # the last character is optional or repeated
+    return pattern[:max(i, 0)]
+
+
+def fold_case(s):
+    """
+    Case folding consistent with re.IGNORECASE: characters matching each other ignoring case are folded to the same
+    string. str.casefold() alone is not, re.IGNORECASE also matches 'i' with the dotless 'ı' and with 'İ', which are
+    folded to 'ı' and 'i̇' (with a combining dot).
+    """
+    return s.casefold().replace('i\u0307', 'i').replace('ı', 'i')
+
+
+class LiteralPrefilter:
+    """
+    Checks if a value may match any of the regex patterns by searching for their literal prefixes in the case folded
+    value at once with an Aho-Corasick automaton built with pyahocorasick. Patterns without literal prefixes are checked
+    with a regex each time. May return false positives, which are ruled out by matching the full regex afterwards, but
+    no false negatives: if the value matches some pattern ignoring case, its case folded version contains the case
+    folded literal prefix of the pattern, see fold_case().
+    """
+    def __init__(self, patterns, flags):
+        literals = [fold_case(literal_prefix(p)) for p in patterns]
+        self.literals = sorted({l for l in literals if l})
+        rest = [p for p, l in zip(patterns, literals) if not l]
+        self.rest = re.compile('|'.join(f'({p})' for p in rest), flags=flags) if rest else None
+        if ahocorasick is None:
+            raise ImportError("The automaton backend requires pyahocorasick, install hplt-textpipes[automaton] or use "
+                              "backend='re'")
+        self.automaton = None
+        if self.literals:
+            self.automaton = ahocorasick.Automaton()
+            for l in self.literals:
+                self.automaton.add_word(l, l)
+            self.automaton.make_automaton()
+
+    def may_match(self, val):
+        if self.rest is not None and self.rest.search(val):
+            return True
+        if self.automaton is None:
+            return False
+        return next(self.automaton.iter(fold_case(val)), None) is not None
+
+
+class TagFilterStats:
+    """
+    Counters of TagFilter2 in the statistics mode, shared between processes: for each (tag, attr) in the filter list the
+    number of attribute values checked and the time spent checking them, for each pattern the number of values it
+    matched. If several patterns of a (tag, attr) match a value, the one matching at the leftmost position is counted,
+    the first of them in the filter list if there are several. Values are not checked for a (tag, attr) after a match
+    for an earlier one is found in the document, so the hits of later patterns are underestimated.
+    Each process counts in its own slots without a lock, see SharedCounters, TagFilter2 claims them when created.
+    """
+    def __init__(self):
+        tagfilters = load_tagfilters()
+        self.keys = list(tagfilters)
+        self.patterns = [list(v) for v in tagfilters.values()]
+        # the values checked for each (tag, attr) followed by the hits of each pattern
+        self.counts = SharedCounters('q', len(self.keys) + sum(len(v) for v in self.patterns))
+        self.seconds = SharedCounters('d', len(self.keys))
+
+    def claim(self):
+        """Claims the slots of the current process, e.g. a pool worker, see SharedCounters.claim()."""
+        self.counts.claim()
+        self.seconds.claim()
+
+    def record(self, i, seconds, pattern=None):
+        """Counts a value checked for the i-th (tag, attr) and matched by the pattern with this global index."""
+        self.counts.add(i)
+        self.seconds.add(i, seconds)
+        if pattern is not None:
+            self.counts.add(len(self.keys) + pattern)
+
+    def to_dict(self):
+        counts, seconds = self.counts.totals(), self.seconds.totals()
+        checked, hits = counts[:len(self.keys)], counts[len(self.keys):]
+        res, pattern = [], 0
+        for (tag, attr), patterns, key_checked, key_seconds in zip(self.keys, self.patterns, checked, seconds):
+            res.append({'tag': tag, 'attr': attr, 'checked': key_checked, 'seconds': round(key_seconds, 6),
+                        'patterns': [{'pattern': p, 'hits': hits[pattern + j]} for j, p in enumerate(patterns)]})
+            pattern += len(patterns)
+        return res
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class TagFilter2:
+    """
+    Selects the candidate elements with one pre-compiled XPath expression, the union of the elements with any of the
+    filtered attributes for each tag, which libxml2 returns in document order. Dispatches each candidate to the
+    pre-compiled regexps for its tag, checks the values with Python re.
+    Returns the same match as TagFilter1, which runs a separate search over the tree for each (tag, attr) in the order
+    of the filter list: the first element in document order among the matches for the first (tag, attr) in the list.
+    Dispatching every element from a single Element.iterdescendants() over the filtered tags in Python was measured
+    to be slower on pages with many elements, since most of them have none of the attributes.
+
+    :param backend: 're' checks values with one regex alternating all patterns for (tag, attr), 'automaton' first
+    searches for literal prefixes of the patterns with LiteralPrefilter and runs the regex only if any of them is found,
+    which scans each value in linear time regardless of the number of patterns; it requires pyahocorasick, which is
+    an optional dependency, see the automaton extra in pyproject.toml
+    :param stats: TagFilterStats to count the hits of the patterns and the time spent matching each (tag, attr)
+    """
+    def __init__(self, backend='re', stats=None):
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown backend {backend}, select among {BACKENDS}')
+        tagfilters = load_tagfilters()
+        ignorecase = True  # ignore case for better matching, though in the original C++ implementation it was not ignored
+        flags = re.IGNORECASE if ignorecase else 0
+        # tag -> [(index of (tag, attr) in the filter list, attr, regex, prefilter)], sorted by the index
+        self.tag2attrs = defaultdict(list)
+        # the global index of the pattern for each group wrapping a pattern in the regex for each (tag, attr)
+        self.group2pattern = []
+        for i, ((tag, attr), v) in enumerate(tagfilters.items()):
+            regex = re.compile('|'.join(f'({t})' for t in v), flags=flags)
+            prefilter = LiteralPrefilter(v, flags) if backend == 'automaton' else None
+            self.tag2attrs[tag].append((i, attr, regex, prefilter))
+            group, group2pattern = 1, {}
+            for t in v:
+                group2pattern[group] = sum(len(g) for g in self.group2pattern) + len(group2pattern)
+                group += 1 + re.compile(t, flags=flags).groups
+            self.group2pattern.append(group2pattern)
+        self.nkeys = len(tagfilters)
+        self.stats = stats
+        if stats is not None:
+            stats.claim()  # before matching, which a watchdog may interrupt by killing the process
+            self.match_element = self._match_element_stats
+        # only the elements having any of the attributes for their tag, in document order
+        self.candidates = etree.XPath(' | '.join(self.xpath_branches()))
+
+    def xpath_branches(self):
+        """The XPath expressions selecting the candidate elements for each tag, see DocumentMetadataExtractor."""
+        return [f'descendant::{tag}[' + ' or '.join(f'@{attr}' for _, attr, _, _ in attrs) + ']'
+                for tag, attrs in self.tag2attrs.items()]
+
+    def match_element(self, e, best):
+        """
+        Returns the index of the first (tag, attr) in the filter list matching the element and the match, or None if
+        none of those before best match. Elements of other tags never match.
+        """
+        for i, attr, regex, prefilter in self.tag2attrs.get(e.tag, ()):
+            if i >= best:
+                break  # a match for an earlier (tag, attr) is already found
+            val = e.get(attr)
+            if val is None or prefilter is not None and not prefilter.may_match(val):
+                continue
+            if regex.search(val):
+                return i, (e.tag, attr, val)
+        return None
+
+    def _match_element_stats(self, e, best):
+        for i, attr, regex, prefilter in self.tag2attrs.get(e.tag, ()):
+            if i >= best:
+                break
+            st = timer()
+            val = e.get(attr)
+            if val is None or prefilter is not None and not prefilter.may_match(val):
+                m = None
+            else:
+                m = regex.search(val)
+            if val is not None:
+                # the group of the whole pattern closes after the groups inside it, so it is the last matched one
+                self.stats.record(i, timer() - st, None if m is None else self.group2pattern[i][m.lastindex])
+            if m is not None:
+                return i, (e.tag, attr, val)
+        return None
+
+    def matches(self, tree):
+        best, res = self.nkeys, None
+        for e in self.candidates(tree):
+            if (m := self.match_element(e, best)) is not None:
+                best, res = m
+                if best == 0:
+                    break
+        return res
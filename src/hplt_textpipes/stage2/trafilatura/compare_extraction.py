@@ -0,0 +1,64 @@
+import io
+import sys
+from collections import Counter
+from timeit import default_timer as timer
+
+import ujson as json
+import fire
+import zstandard
+from trafilatura.utils import load_html
+
+from hplt_textpipes.stage2.trafilatura.traf import traf_config, extract_two_pass, extract_single_pass
+
+
+def compare(fpath: str = '-', limit: int = None, mismatches: str = None):
+    """
+    Regression check for the single-pass extraction mode of traf.py: runs both extract_two_pass() and
+    extract_single_pass() for each HTML and reports how often the text and the xml outputs match.
+    Writes the summary to stdout.
+
+    :param fpath: path to html.zst or '-' to read uncompressed jsonlines from stdin
+    :param limit: process only this many first documents
+    :param mismatches: if specified, write jsonlines with the outputs of both modes for mismatching documents here
+    """
+    config = traf_config()
+    cnt = Counter()
+    durs = Counter()
+    with sys.stdin.buffer if fpath == '-' else io.BufferedReader(zstandard.open(fpath, 'rb')) as inp, \
+            open(mismatches, 'w') if mismatches else io.StringIO() as mout:
+        for i, byteline in enumerate(inp):
+            if limit is not None and i >= limit:
+                break
+            cnt['docs'] += 1
+            try:
+                html = json.loads(byteline.decode('utf-8', errors='ignore'))['h']
+                # each mode gets its own tree since Trafilatura changes it
+                st = timer()
+                tree = load_html(html)
+                res2 = extract_two_pass(tree, config) if tree is not None else (None, None)
+                durs['two_pass'] += timer() - st
+
+                st = timer()
+                tree = load_html(html)
+                res1 = extract_single_pass(tree, config) if tree is not None else (None, None)
+                durs['single_pass'] += timer() - st
+            except Exception:
+                cnt['errors'] += 1
+                continue
+
+            for field, v2, v1 in zip(('t', 'x'), res2, res1):
+                cnt[f'{field}_match' if v1 == v2 else f'{field}_mismatch'] += 1
+            if res1 != res2:
+                mout.write(json.dumps({'line': i, 'two_pass': res2, 'single_pass': res1}) + '\n')
+
+    for k in ('docs', 'errors', 't_match', 't_mismatch', 'x_match', 'x_mismatch'):
+        print(f'{k}\t{cnt[k]}')
+    ok = cnt['docs'] - cnt['errors']
+    for field in ('t', 'x'):
+        print(f'{field}_match_rate\t{cnt[f"{field}_match"] / max(ok, 1):.4f}')
+    for mode in ('two_pass', 'single_pass'):
+        print(f'{mode}_seconds\t{durs[mode]:.2f}')
+
+
+if __name__ == '__main__':
+    fire.Fire(compare)
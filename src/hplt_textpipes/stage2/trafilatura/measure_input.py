@@ -0,0 +1,54 @@
+import io
+import itertools
+from timeit import default_timer as timer
+
+import ujson as json
+import fire
+import zstandard
+
+from hplt_textpipes.stage2.trafilatura.traf import decode_input, parse_input, UNDECODABLE
+
+
+def parse_input_old(byteline, decoding_errors, errors):
+    """Input parsing as done by traf_doc() before parse_input() was introduced."""
+    line = decode_input(byteline, decoding_errors, errors)
+    return UNDECODABLE if line is UNDECODABLE else json.loads(line.strip())
+
+
+def measure(*fpaths: str, limit: int = 10000, repeat: int = 3, decoding_errors: str = 'ignore'):
+    """
+    Micro-benchmark for the input parsing in traf.py: compares the time spent per line to get the 'h' field with
+    the old path (strict UTF-8 decoding, strip, ujson) and the orjson fast path in parse_input(). Also checks that
+    both return the same HTMLs.
+
+    :param fpaths: html.zst files to take samples from
+    :param limit: number of first lines to take from each file
+    :param repeat: number of times to parse the sample with each method, the best time is reported
+    """
+    lines = []
+    for fpath in fpaths:
+        with io.BufferedReader(zstandard.open(fpath, 'rb')) as inp:
+            lines.extend(itertools.islice(inp, limit))
+    mb = sum(len(l) for l in lines) / 2**20
+
+    results = {}
+    for name, f in (('old', parse_input_old), ('orjson', parse_input)):
+        best = None
+        for _ in range(repeat):
+            htmls = []
+            st = timer()
+            for byteline in lines:
+                d = f(byteline, decoding_errors, [])
+                htmls.append(None if d is UNDECODABLE else d['h'])
+            dur = timer() - st
+            best = dur if best is None else min(best, dur)
+        results[name] = htmls
+        print(f'{name}\tlines={len(lines)}\tMB={mb:.1f}\tus_per_line={best / len(lines) * 1e6:.1f}\t'
+              f'MB_per_s={mb / best:.1f}')
+
+    mismatches = sum(a != b for a, b in zip(results['old'], results['orjson']))
+    print(f'mismatches\t{mismatches}')
+
+
+if __name__ == '__main__':
+    fire.Fire(measure)
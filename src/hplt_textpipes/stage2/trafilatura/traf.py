@@ -1,24 +1,45 @@
 import io
 import sys
+import multiprocessing
 
 import ujson as json
+import orjson
 import trafilatura
 import fire
 import zstandard
 import traceback
-from trafilatura.settings import use_config
-from trafilatura.utils import load_html
+from trafilatura.settings import use_config, Extractor
+from trafilatura.utils import load_html, normalize_unicode
+from trafilatura.core import bare_extraction, determine_returnstring
+from trafilatura.deduplication import content_fingerprint
+from trafilatura.xml import xmltotxt
+from trafilatura.main_extractor import NOT_AT_THE_END
+from trafilatura.htmlprocessing import delete_element
+from lxml.etree import strip_elements
 import signal
 from contextlib import contextmanager, nullcontext
-from hplt_textpipes.stage2.tagfilter.tagfilter1 import TagFilter1 as TagFilter
-from hplt_textpipes.stage2.tagfilter.tagextractor import extract_lang_info
-from copy import deepcopy
+from functools import partial
+from collections import Counter
+from hplt_textpipes.stage2.tagfilter.tagfilter1 import load_tagfilters
+from hplt_textpipes.stage2.tagfilter.tagfilter2 import TagFilter2 as TagFilter, TagFilterStats
+from hplt_textpipes.stage2.tagfilter.tagextractor import DocumentMetadataExtractor, EXTRA_FIELDS
+from hplt_textpipes.stage2.tagfilter.prescreen import TagFilterPrescreen
+from hplt_textpipes.utils.ordered_pool import iter_batches, ordered_imap, ReorderBuffer
+from hplt_textpipes.utils.watchdog_pool import WatchdogPool
+from hplt_textpipes.utils.jsonl_writer import JsonlWriter, dumps_line
+from hplt_textpipes.utils.result_cache import ResultCache
+from hplt_textpipes.lid.registry import resolve_model_path
+from concurrent.futures import Future, ProcessPoolExecutor
+from copy import copy, deepcopy
 
 class CustomTimeoutError(BaseException):
     """ We need a special exception class directly inherited from BaseException because Trafilatura  code catches
     Exception and thus all derived classes including the standard TimeoutError, which breaks time limits. """
     pass
 
+TIMEOUT_ENGINES = ('signal', 'watchdog')
+
+
 def timeout_handler(signum, frame):
     raise CustomTimeoutError()
 
@@ -35,57 +56,476 @@ def time_limit(seconds):
         signal.setitimer(signal.ITIMER_REAL, 0)
 
 
-def traf(instream, decoding_errors, timelimit_perdoc=None, matcher=None):
-    trafilatura_text_options = {"include_comments": True, "include_tables": False,
-                                "no_fallback": False, "favor_precision": True, "favor_recall": False}
-    trafilatura_xml_options = trafilatura_text_options | {"include_comments": True, "include_tables": True,
-                                                          "with_metadata": False, "include_formatting": True}
-    min_extracted_size = 0
+TRAFILATURA_TEXT_OPTIONS = {"include_comments": True, "include_tables": False,
+                            "no_fallback": False, "favor_precision": True, "favor_recall": False}
+TRAFILATURA_XML_OPTIONS = TRAFILATURA_TEXT_OPTIONS | {"include_comments": True, "include_tables": True,
+                                                      "with_metadata": False, "include_formatting": True}
+
+
+def traf_config(min_extracted_size=0):
     config = use_config()
     config.set("DEFAULT", "MIN_EXTRACTED_SIZE", str(min_extracted_size))
+    return config
+
+
+def traf_xml_extractor(config):
+    """
+    Returns trafilatura.settings.Extractor with the same settings as TRAFILATURA_XML_OPTIONS passed to extract().
+    """
+    o = TRAFILATURA_XML_OPTIONS
+    return Extractor(config=config, output_format='xml', fast=o['no_fallback'], precision=o['favor_precision'],
+                     recall=o['favor_recall'], comments=o['include_comments'], formatting=o['include_formatting'],
+                     tables=o['include_tables'], with_metadata=o['with_metadata'])
+
+
+def extract_two_pass(tree, config):
+    """
+    Extracts text and xml with two runs of Trafilatura, returns a tuple (text, xml).
+    """
+    # trafilatura.extract() changes the tree, so the first run gets a copy
+    text = trafilatura.extract(deepcopy(tree), config=config, **TRAFILATURA_TEXT_OPTIONS)
+    xml = trafilatura.extract(tree, output_format='xml', config=config, **TRAFILATURA_XML_OPTIONS)
+    return text, xml
+
+
+def extract_single_pass(tree, config):
+    """
+    Extracts text and xml with one run of Trafilatura, returns a tuple (text, xml).
+    The extraction is done with the xml settings, then the text is rendered from the extracted xml tree without
+    tables and formatting. This avoids copying the whole html tree and running boilerplate removal twice.
+    The xml is the same as from extract_two_pass(), and so is the text for all documents of bench/data, see
+    compare_extraction.py, but not for all documents in general, e.g. with tables excluded Trafilatura keeps the text
+    directly following a table, e.g. of a link after it, which the xml extraction drops with the table, so it cannot
+    be recovered from the xml tree.
+    """
+    options = traf_xml_extractor(config)
+    document = bare_extraction(tree, options=options)
+    if document is None:
+        return None, None
+
+    # render text the same way as trafilatura.extract(output_format='txt') does, but from a copy of the extracted
+    # tree without tables; the copy is small and is required because determine_returnstring() changes document.body
+    body = copy(document.body)
+    if not TRAFILATURA_TEXT_OPTIONS['include_tables']:
+        trailing_table = len(body) > 0 and body[-1].tag == 'table'
+        strip_elements(body, 'table', with_tail=False)
+        # trafilatura removes the trailing titles after extraction, those before a table at the end are trailing in
+        # the extraction without tables only
+        while trailing_table and len(body) > 0 and body[-1].tag in NOT_AT_THE_END:
+            delete_element(body[-1], keep_tail=False)
+    text = xmltotxt(body, include_formatting=False)
+    if document.commentsbody is not None:
+        text = f"{text}\n{xmltotxt(document.commentsbody, include_formatting=False)}".strip()
+    text = normalize_unicode(text)
+
+    # post-processing from trafilatura.extract() for the xml output
+    if document.raw_text is not None:
+        document.fingerprint = content_fingerprint(str(document.title) + " " + str(document.raw_text))
+    xml = determine_returnstring(document, options)
+    return text, xml
+
+
+# returned by parse_input() for lines that cannot be decoded with decoding_errors='strict'
+UNDECODABLE = object()
+
+
+def decode_input(byteline, decoding_errors, errors):
+    """
+    Decodes the input line from UTF-8, returns UNDECODABLE if it is not valid UTF-8 and decoding_errors is 'strict'.
+    Appends 'UnicodeDecodeError' to errors if the line is not valid UTF-8.
+    """
+    try:
+        return byteline.decode('utf-8', errors='strict')
+    except UnicodeDecodeError as e:
+        errors.append('UnicodeDecodeError')
+        return UNDECODABLE if decoding_errors == 'strict' else byteline.decode('utf-8', errors=decoding_errors)
+
+
+def parse_input(byteline, decoding_errors, errors):
+    """
+    Parses the input jsonline, returns UNDECODABLE if it is not valid UTF-8 and decoding_errors is 'strict'.
+    orjson parses bytes directly and validates UTF-8 while parsing, so valid lines, i.e. almost all of them, are parsed
+    without decoding them to str and stripping first. Only the lines rejected by orjson (invalid UTF-8, lone surrogates
+    escaped in JSON strings, invalid JSON) take the slow path, which is the same as before introducing the fast one.
+    """
+    try:
+        return orjson.loads(byteline)
+    except orjson.JSONDecodeError:
+        pass
+    line = decode_input(byteline, decoding_errors, errors)
+    return UNDECODABLE if line is UNDECODABLE else json.loads(line.strip())
+
+
+def traf_doc(byteline, decoding_errors, timelimit_perdoc, extractor, config, single_pass=False, max_nodes=None,
+             prescreen=None):
+    """
+    Processes one input line, returns a dictionary with the extracted text, metadata and errors if any.
+    The metadata are the tag filter match, language info and other fields returned by the DocumentMetadataExtractor.
+    If max_nodes is specified and the HTML tree has more elements, returns None without extracting anything.
+    If prescreen is specified, the tag filters are matched only for the lines passing TagFilterPrescreen.may_match().
+    """
+    errors = []
+    res = {}
+
+    res['t'] = None  # LID requires that the 't' field is always present, even if None
+    try:
+        d = parse_input(byteline, decoding_errors, errors)
+        if d is not UNDECODABLE:
+            html = d['h']
+            with time_limit(timelimit_perdoc) if timelimit_perdoc else nullcontext():
+                tree = load_html(html)
+                if tree is None:
+                    raise ValueError("Could not parse HTML")
+                if max_nodes is not None and tree.xpath('count(//*)') > max_nodes:
+                    return None
+                # lines with decoding errors are not prescreened, dropping invalid bytes may join parts of a pattern
+                match_tagfilters = prescreen is None or bool(errors) or prescreen.may_match(byteline)
+                res.update(extractor.extract(tree, match_tagfilters))
+                # Trafilatura changes the tree, tagfilters should be matched before
+                extract = extract_single_pass if single_pass else extract_two_pass
+                res['t'], res['x'] = extract(tree, config)
+    except CustomTimeoutError as e:
+        errors.append(f'Trafilatura timed out: {timelimit_perdoc}s')
+    except Exception as e:
+        errors.append(traceback.format_exc())
+
+    if errors:
+        res['traferr'] = errors
+    return res
+
+
+def timeout_record(byteline, timelimit_perdoc):
+    """
+    Returns the output for a document which processing was interrupted by the watchdog. Errors are the same as if it was
+    interrupted by time_limit(), but other fields extracted before the timeout are not available.
+    """
+    errors = []
+    try:
+        byteline.decode('utf-8', errors='strict')
+    except UnicodeDecodeError as e:
+        errors.append('UnicodeDecodeError')
+    errors.append(f'Trafilatura timed out: {timelimit_perdoc}s')
+    return {'t': None, 'traferr': errors}
+
+
+def open_cache(cache_path, cache_max_mb, single_pass, lid_model=None, metadata_fields=(), lid_identity='openlid-v2',
+               decoding_errors='ignore'):
+    """
+    Opens the cache of outputs for input lines processed before, e.g. the same boilerplate pages found in several
+    crawls. The keys are hashes of the whole input lines rather than of the HTMLs in them, so that lines are looked up
+    without parsing them; the lines of stage2 have no other fields. Outputs depend also on the version of Trafilatura,
+    the extraction mode, the handling of decoding errors, the tag filters, the LID model and its identity if LID is
+    fused and the additional metadata fields, cache entries made with other ones are not used.
+    """
+    namespace = f'{trafilatura.__version__}\t{single_pass}\t{sorted(load_tagfilters().items())}\t{lid_model}' \
+                f'\t{decoding_errors}'
+    if lid_model and lid_identity != 'openlid-v2':
+        namespace += f'\t{lid_identity}'  # keeps the entries made before other identities were supported
+    if metadata_fields:
+        namespace += f'\t{list(metadata_fields)}'  # keeps the entries made before these fields were introduced
+    return ResultCache(cache_path, cache_max_mb * 2**20, namespace)
+
+
+def _cacheable(outline):
+    # timeouts depend on the load of the machine, other errors are determined by the input; 'traferr' is the last field
+    # and cannot occur in the serialized text fields because quotes are escaped there
+    i = outline.rfind(b',"traferr":[')
+    return i < 0 or b'Trafilatura timed out' not in outline[i:]
+
+
+def _cache_put(cache, byteline, outline):
+    if cache is not None and _cacheable(outline):
+        cache.put(cache.key(byteline), outline)
+
+
+def _cache_get(cache, byteline):
+    return None if cache is None else cache.get(cache.key(byteline))
+
+
+def _cached_submit(cache, submit, batch):
+    """
+    Same as submit(batch), but only the lines not found in the cache are submitted, outputs for them are added to the
+    cache when ready.
+    """
+    outlines = [_cache_get(cache, byteline) for byteline in batch]
+    misses = [i for i, outline in enumerate(outlines) if outline is None]
+    future = Future()
+
+    def on_done(f):
+        if f.exception() is not None:
+            future.set_exception(f.exception())
+            return
+        for i, outline in zip(misses, f.result()):
+            outlines[i] = outline
+            _cache_put(cache, batch[i], outline)
+        future.set_result(outlines)
+
+    submit([batch[i] for i in misses]).add_done_callback(on_done)
+    return future
+
+
+def output_lines(res, lid):
+    """
+    Serializes the output of traf_doc(). If lid is specified, appends the line with the output of LID for the extracted
+    text, which saves serializing the text and parsing it again in a separate LID step; see SplitWriter.
+    """
+    outline = dumps_line(res)
+    return outline if lid is None else outline + dumps_line(lid.predict_text(res['t']))
+
+
+def output_batch(results, lid):
+    """output_lines() for a batch of the outputs of traf_doc(), running LID for all the texts with one call."""
+    if lid is None:
+        return [None if res is None else dumps_line(res) for res in results]
+    langs = iter(lid.predict_batch([res['t'] for res in results if res is not None]))
+    return [None if res is None else dumps_line(res) + dumps_line(next(langs)) for res in results]
+
+
+class SplitWriter:
+    """
+    Receives pairs of lines from output_lines() with LID fused and writes them to text_writer and lang_writer
+    respectively.
+    """
+    def __init__(self, text_writer, lang_writer):
+        self.text_writer, self.lang_writer = text_writer, lang_writer
+
+    def write_line(self, outlines):
+        # serialized json has no newlines inside, the first one ends the text line
+        i = outlines.index(b'\n') + 1
+        view = memoryview(outlines)
+        self.text_writer.write_line(view[:i])
+        self.lang_writer.write_line(view[i:])
+
+    def close(self):
+        self.text_writer.close()
+        self.lang_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def traf(instream, decoding_errors, timelimit_perdoc=None, extractor=None, single_pass=False, cache=None, lid=None,
+         writer=None, prescreen=None):
+    config = traf_config()
+    with JsonlWriter() if writer is None else nullcontext(writer) as writer:
+        for byteline in instream:
+            outline = _cache_get(cache, byteline)
+            if outline is None:
+                res = traf_doc(byteline, decoding_errors, timelimit_perdoc, extractor, config, single_pass,
+                               prescreen=prescreen)
+                outline = output_lines(res, lid)
+                _cache_put(cache, byteline, outline)
+            writer.write_line(outline)
+
+
+def load_lid(lid_model, lid_identity='openlid-v2'):
+    # imported only when LID is fused, since importing fasttext and numpy takes longer than the rest of traf.py
+    # except Trafilatura
+    from hplt_textpipes.stage2.fastertext_lid.proto_langid import FastTextLangId
+    return FastTextLangId(lid_model, identity=lid_identity)
+
+
+# the state of a pool worker, initialized once per worker process by _init_worker()
+_worker_kwargs = None
+_worker_lid = None
+
+
+def _init_worker(kwargs, lid_model=None, lid_identity=None, prescreen_counts=None, metadata_fields=(),
+                 tagfilter_stats=None):
+    global _worker_kwargs, _worker_lid
+    # the workers share the counters of the prescreen and tagfilter_stats created in the parent process
+    prescreen = TagFilterPrescreen(prescreen_counts) if prescreen_counts is not None else None
+    extractor = DocumentMetadataExtractor(TagFilter(stats=tagfilter_stats), metadata_fields)
+    _worker_kwargs = kwargs | {'extractor': extractor, 'config': traf_config(), 'prescreen': prescreen}
+    if lid_model and _worker_lid is None:
+        _worker_lid = load_lid(lid_model, lid_identity)  # normally loaded before forking the worker, see traf_pool()
+
+
+def _traf_line(byteline):
+    # serialize in the worker to offload the parent process, which only writes the results
+    res = traf_doc(byteline, **_worker_kwargs)
+    return None if res is None else output_lines(res, _worker_lid)
+
+
+def _traf_batch(bytelines):
+    return output_batch([traf_doc(byteline, **_worker_kwargs) for byteline in bytelines], _worker_lid)
+
+
+def _timeout_line(byteline, timelimit_perdoc, with_lang):
+    outline = dumps_line(timeout_record(byteline, timelimit_perdoc))
+    return outline + dumps_line({'lang': None}) if with_lang else outline
+
+
+def _start_lane(njobs, timeout_engine, worker_kwargs, init_args):
+    """
+    Starts a pool of workers calling traf_doc(**worker_kwargs) and LID if init_args specify the model, returns the pool
+    and the function submitting batches of lines to it, see ordered_imap().
+
+    :param init_args: the arguments of _init_worker() following kwargs
+    """
+    timelimit_perdoc = worker_kwargs['timelimit_perdoc']
+    if timeout_engine == 'watchdog' and timelimit_perdoc:
+        on_timeout = partial(_timeout_line, timelimit_perdoc=timelimit_perdoc, with_lang=bool(init_args[0]))
+        pool = WatchdogPool(njobs, _traf_line, timelimit_perdoc, on_timeout, initializer=_init_worker,
+                            initargs=(worker_kwargs | {'timelimit_perdoc': None}, *init_args))
+        return pool, pool.submit
+    # unlike multiprocessing.Pool, which silently loses the batch of a worker killed e.g. by the OOM killer and waits
+    # for it forever, ProcessPoolExecutor fails the pending futures with BrokenProcessPool, aborting the run
+    pool = ProcessPoolExecutor(njobs, mp_context=multiprocessing.get_context('fork'), initializer=_init_worker,
+                               initargs=(worker_kwargs, *init_args))
+    return pool, partial(pool.submit, _traf_batch)
+
+
+def _report_killed(pool, timelimit_perdoc):
+    if isinstance(pool, WatchdogPool) and pool.killed:
+        print(f'traf.py: {pool.killed} workers killed by the watchdog after {timelimit_perdoc}s timeouts',
+              file=sys.stderr)
+
+
+def traf_pool(instream, njobs, batch_size, timeout_engine='signal', slow_lane_njobs=0, slow_lane_bytes=None,
+              slow_lane_nodes=None, slow_lane_timelimit=None, cache=None, writer=None, lid_model=None, prescreen=None,
+              metadata_fields=(), tagfilter_stats=None, lid_identity='openlid-v2', **worker_kwargs):
+    """
+    Same as traf(), but the input lines are sent in batches to a pool of persistent worker processes. Trafilatura is
+    imported and the tag filters are compiled once per worker rather than once per block of input as with GNU parallel.
+    The outputs are written in the order of the input lines.
+
+    Time limits per document are implemented by one of the engines:
+    - signal: time_limit() based on SIGALRM in the workers, which works because each of them processes documents in its
+    main thread;
+    - watchdog: the parent process kills the worker exceeding the time limit, writes timeout_record() for the document
+    and starts a new worker for the rest of the batch, this does not depend on the way documents are processed.
+
+    If slow_lane_njobs>0, see traf_triage().
+    If cache is specified, the lines found there are not sent to the workers, see open_cache().
+    The output lines are passed to writer.write_line(), JsonlWriter writing to stdout by default. If lid_model is
+    specified, the workers also run LID with the model of lid_identity and the writer receives pairs of lines from
+    output_lines(), see SplitWriter.
+    If prescreen is specified, the workers run the prescreen of the same class counting the documents in it.
+    The workers extract metadata_fields besides the tag filter match and language info, see DocumentMetadataExtractor.
+    If tagfilter_stats is specified, the workers count the hits of the tag filters in it, see TagFilterStats.
+
+    :param worker_kwargs: the arguments of traf_doc() except byteline, extractor, config and prescreen
+    """
+    if timeout_engine not in TIMEOUT_ENGINES:
+        raise ValueError(f'Unknown timeout engine {timeout_engine}, select among {TIMEOUT_ENGINES}')
+    global _worker_lid
+    # the workers forked after loading the LID model share its pages instead of loading a private copy each
+    _worker_lid = load_lid(lid_model, lid_identity) if lid_model else None
+    init_args = (lid_model, lid_identity, prescreen.counts if prescreen is not None else None, metadata_fields,
+                 tagfilter_stats)
+    if slow_lane_njobs > 0:
+        traf_triage(instream, njobs, batch_size, timeout_engine, slow_lane_njobs, slow_lane_bytes, slow_lane_nodes,
+                    slow_lane_timelimit, cache, writer, init_args, worker_kwargs)
+        return
+
+    pool, submit = _start_lane(njobs, timeout_engine, worker_kwargs, init_args)
+    if cache is not None:
+        submit = partial(_cached_submit, cache, submit)
+    with pool, JsonlWriter() if writer is None else nullcontext(writer) as writer:
+        # a few batches per worker in flight keep the workers busy while the oldest batch is being finished
+        for outlines in ordered_imap(submit, iter_batches(instream, batch_size), max_pending=2 * njobs):
+            for outline in outlines:
+                writer.write_line(outline)
+    _report_killed(pool, worker_kwargs['timelimit_perdoc'])
+
+
+def traf_triage(instream, njobs, batch_size, timeout_engine, slow_lane_njobs, slow_lane_bytes, slow_lane_nodes,
+                slow_lane_timelimit, cache, writer, init_args, worker_kwargs):
+    """
+    Same as traf_pool(), but large documents are processed by a separate pool of slow_lane_njobs workers with its own
+    time limit slow_lane_timelimit. A document goes to the slow lane if its input line is longer than slow_lane_bytes,
+    or if its HTML tree has more than slow_lane_nodes elements; the latter is checked by the fast lane workers after
+    parsing, they skip such documents and these are resubmitted to the slow lane.
+    Results from both lanes are collected in a reorder buffer which writes them in the order of the input lines, so the
+    fast lane goes on with the following documents while the slow lane is busy with large ones. The number of documents
+    read but not written yet is limited to keep the memory bounded.
+    """
+    slow_lane_timelimit = slow_lane_timelimit or worker_kwargs['timelimit_perdoc']
+    fast, fast_submit = _start_lane(njobs, timeout_engine, worker_kwargs | {'max_nodes': slow_lane_nodes}, init_args)
+    slow, slow_submit = _start_lane(slow_lane_njobs, timeout_engine,
+                                    worker_kwargs | {'timelimit_perdoc': slow_lane_timelimit}, init_args)
+    buf = ReorderBuffer()
+    cnt = Counter()
+
+    def on_slow_done(seq, byteline, future):
+        if future.exception() is not None:
+            buf.fail(future.exception())
+        else:
+            _cache_put(cache, byteline, future.result()[0])
+            buf.put(seq, future.result()[0])
+
+    def to_slow(seq, byteline, reason):
+        cnt[reason] += 1
+        slow_submit([byteline]).add_done_callback(partial(on_slow_done, seq, byteline))
+
+    def on_fast_done(seqs, batch, future):
+        if future.exception() is not None:
+            buf.fail(future.exception())
+            return
+        for seq, byteline, outline in zip(seqs, batch, future.result()):
+            if outline is None:
+                to_slow(seq, byteline, 'nodes')
+            else:
+                _cache_put(cache, byteline, outline)
+                buf.put(seq, outline)
+
+    def to_fast(seqs, batch):
+        fast_submit(batch).add_done_callback(partial(on_fast_done, seqs, batch))
+
+    max_inflight = 2 * (njobs * batch_size + slow_lane_njobs)
+    with fast, slow, JsonlWriter() if writer is None else nullcontext(writer) as writer:
+        # sequence numbers in a batch are not consecutive if some lines went to the slow lane or were found in the cache
+        seq, seqs, batch = 0, [], []
+        for byteline in instream:
+            if (outline := _cache_get(cache, byteline)) is not None:
+                buf.put(seq, outline)
+            elif slow_lane_bytes and len(byteline) > slow_lane_bytes:
+                to_slow(seq, byteline, 'bytes')
+            else:
+                seqs.append(seq)
+                batch.append(byteline)
+                if len(batch) == batch_size:
+                    to_fast(seqs, batch)
+                    seqs, batch = [], []
+            seq += 1
+
+            for outline in buf.pop_ready():
+                writer.write_line(outline)
+            if seq - buf.next >= max_inflight:
+                if batch:  # the document waited for may be in the incomplete batch
+                    to_fast(seqs, batch)
+                    seqs, batch = [], []
+                while seq - buf.next >= max_inflight:
+                    writer.write_line(buf.pop_next())
+
+        if batch:
+            to_fast(seqs, batch)
+        while buf.next < seq:
+            writer.write_line(buf.pop_next())
+
+    print(f'traf.py: {cnt["bytes"] + cnt["nodes"]} documents processed in the slow lane, '
+          f'{cnt["bytes"]} exceeding {slow_lane_bytes} bytes, {cnt["nodes"]} exceeding {slow_lane_nodes} nodes',
+          file=sys.stderr)
+    _report_killed(fast, worker_kwargs['timelimit_perdoc'])
+    _report_killed(slow, slow_lane_timelimit)
+
+
+def open_lang_output(lang_output):
+    if not lang_output:
+        return nullcontext()
+    return zstandard.open(lang_output, 'wb') if lang_output.endswith('.zst') else open(lang_output, 'wb')
+
 
-    for byteline in instream:
-        # st = timer()
-        errors = []
-        res = {}
-
-        try:
-            line = byteline.decode('utf-8', errors='strict')
-        except UnicodeDecodeError as e:
-            errors.append('UnicodeDecodeError')
-            line = None if decoding_errors == 'strict' else byteline.decode('utf-8', errors=decoding_errors)
-
-        res['t'] = None  # LID requires that the 't' field is always present, even if None
-        if line is not None:
-            try:
-                d = json.loads(line.strip())
-                html = d['h']
-                with time_limit(timelimit_perdoc) if timelimit_perdoc else nullcontext():
-                    tree = load_html(html)
-                    if tree is None:
-                        raise ValueError("Could not parse HTML")
-                    tagmatch = matcher.matches(tree)
-                    if tagmatch is not None:
-                        res['tagfilter'] = tagmatch
-                    res.update(extract_lang_info(tree))
-                    # trafilatura.extract() changes the tree, tagfilters should be matched before
-                    res['t'] = trafilatura.extract(deepcopy(tree), config=config, **trafilatura_text_options)
-                    res['x'] = trafilatura.extract(tree, output_format='xml', config=config, **trafilatura_xml_options)
-            except CustomTimeoutError as e:
-                errors.append(f'Trafilatura timed out: {timelimit_perdoc}s')
-            except Exception as e:
-                errors.append(traceback.format_exc())
-
-        # dur = timer() - st
-        # res['dur'] = f'{dur:.1e}'
-
-        if errors:
-            res['traferr'] = errors
-
-        print(json.dumps(res))
-
-
-def main(fpath: str = '-', decoding_errors: str = 'ignore', timelimit_perdoc: float = None):
+def main(fpath: str = '-', decoding_errors: str = 'ignore', timelimit_perdoc: float = None,
+         njobs: int = 0, batch_size: int = 100, single_pass: bool = False, timeout_engine: str = 'signal',
+         slow_lane_njobs: int = 0, slow_lane_bytes: int = None, slow_lane_nodes: int = None,
+         slow_lane_timelimit: float = None, cache_path: str = None, cache_max_mb: int = 10240, lid_model: str = None,
+         lang_output: str = None, tagfilter_prescreen: bool = False, metadata_fields: str = None,
+         tagfilter_stats: str = None, lid_identity: str = 'openlid-v2'):
     """
     Extracts texts from HTMLs using Trafilatura library.
     Reads jsonlines with "h" field containing HTMLs from stdin or file. Writes jsonlines to stdout containing text
@@ -97,10 +537,68 @@ def main(fpath: str = '-', decoding_errors: str = 'ignore', timelimit_perdoc: fl
     the script will always try to decode in 'strict' mode to detect and report any errors, if decoding_errors!='strict'
     then in case of errors will retry using the specified mode.
     :param timelimit_perdoc: sets maximum time (in seconds) for processing 1 document with Trafilatura
+    :param njobs: if >0, process documents in a pool of this many worker processes, otherwise in the current process
+    :param batch_size: number of input lines sent to a worker at once when njobs>0
+    :param single_pass: experimental, extract both text and xml with one run of Trafilatura, see
+    extract_single_pass(); the text misses the text directly following a table that the default extraction keeps,
+    so run.py does not offer this mode until it is exact
+    :param timeout_engine: how timelimit_perdoc is enforced when njobs>0, 'signal' or 'watchdog', see traf_pool();
+    processing in the current process supports 'signal' only
+    :param slow_lane_njobs: if >0, process large documents in a separate pool of this many workers, see traf_triage()
+    :param slow_lane_bytes: send documents with input lines longer than this to the slow lane
+    :param slow_lane_nodes: send documents with HTML trees of more than this many elements to the slow lane
+    :param slow_lane_timelimit: timelimit_perdoc for the slow lane, the same as for other documents by default
+    :param cache_path: path to an SQLite database to reuse the outputs for the input lines seen before, see open_cache()
+    :param cache_max_mb: the maximum size of the outputs stored in the cache, the least recently used are evicted
+    :param lid_model: path to the FastText model to identify languages of the extracted texts in the same processes,
+    the outputs are written to lang_output in the format of proto_langid.py; if the file does not exist, the model of
+    lid_identity is looked for in $HPLT_CACHE or ~/.cache/hplt
+    :param lang_output: path to the output file for LID, compressed with zstd if it ends with .zst
+    :param metadata_fields: comma-separated names of additional fields to extract from HTMLs among title, canonical
+    and og, see EXTRA_FIELDS in tagextractor.py
+    :param tagfilter_prescreen: match the tag filters only for the documents which input lines may match them, see
+    TagFilterPrescreen; the skip rate is reported to stderr. The prescreen scans the whole line several times, which
+    may take longer than matching the tree with TagFilter2, compare them with bench/tagfilter.py on your data
+    :param tagfilter_stats: path to write the statistics of the tag filters as JSON at the end: the hits of each pattern
+    and the time spent matching each (tag, attr), aggregated across the workers, see TagFilterStats
+    :param lid_identity: the identity of lid_model, e.g. openlid-v3 or glotlid-v3, which selects the preprocessing of
+    the texts, see hplt_textpipes.lid.registry
     """
-    matcher = TagFilter()
-    with sys.stdin.buffer if fpath == '-' else io.BufferedReader(zstandard.open(fpath, 'rb')) as inp:
-        traf(inp, decoding_errors, timelimit_perdoc, matcher)
+    if njobs == 0 and (timeout_engine != 'signal' or slow_lane_njobs > 0):
+        raise ValueError('Timeout engines other than signal and the slow lane require njobs>0')
+    if bool(lid_model) != bool(lang_output):
+        raise ValueError('lid_model and lang_output should be specified together')
+    if lid_model:
+        model_path = resolve_model_path(lid_identity, lid_model)
+        if model_path is None:
+            raise ValueError(f'Missing model file {lid_model} for {lid_identity}')
+        lid_model = model_path
+    metadata_fields = tuple(metadata_fields.split(',') if isinstance(metadata_fields, str) else metadata_fields or ())
+    if unknown := set(metadata_fields) - set(EXTRA_FIELDS):
+        raise ValueError(f'Unknown metadata fields {unknown}, select among {list(EXTRA_FIELDS)}')
+    with sys.stdin.buffer if fpath == '-' else io.BufferedReader(zstandard.open(fpath, 'rb')) as inp, \
+            open_cache(cache_path, cache_max_mb, single_pass, lid_model, metadata_fields, lid_identity,
+                       decoding_errors) if cache_path \
+            else nullcontext() as cache, \
+            open_lang_output(lang_output) as lang_stream, \
+            JsonlWriter() if not lid_model else SplitWriter(JsonlWriter(), JsonlWriter(lang_stream)) as writer:
+        prescreen = TagFilterPrescreen() if tagfilter_prescreen else None
+        stats = TagFilterStats() if tagfilter_stats else None
+        if njobs > 0:
+            traf_pool(inp, njobs, batch_size, timeout_engine, slow_lane_njobs, slow_lane_bytes, slow_lane_nodes,
+                      slow_lane_timelimit, cache, writer, lid_model, prescreen, metadata_fields, stats,
+                      lid_identity=lid_identity, decoding_errors=decoding_errors,
+                      timelimit_perdoc=timelimit_perdoc, single_pass=single_pass)
+        else:
+            lid = load_lid(lid_model, lid_identity) if lid_model else None
+            extractor = DocumentMetadataExtractor(TagFilter(stats=stats), metadata_fields)
+            traf(inp, decoding_errors, timelimit_perdoc, extractor, single_pass, cache, lid, writer, prescreen)
+        if cache is not None:
+            cache.report('traf.py')
+        if prescreen is not None:
+            prescreen.report('traf.py')
+        if stats is not None:
+            stats.dump(tagfilter_stats)
 
 
 if __name__ == '__main__':
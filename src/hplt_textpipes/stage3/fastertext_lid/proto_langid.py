@@ -4,21 +4,26 @@ from __future__ import annotations
 
 import argparse
 import fileinput
+import itertools
 import logging
+import multiprocessing
 
-import fasttext
-import numpy
-import regex
 import ujson
 import os
 import sys;
-from pathlib import Path;
+from concurrent.futures import ProcessPoolExecutor;
+from functools import partial;
 
+from hplt_textpipes.lid.engine import LidEngine
+from hplt_textpipes.lid.registry import resolve_model_path as resolve_registered_model_path
 from hplt_textpipes.stage2.fastertext_lid.basic_log import langid_logger
-from hplt_textpipes.stage2.fastertext_lid.patterns import NONWORD_REPLACE_PATTERN, SPACE_PATTERN
 from hplt_textpipes.stage3.xml2md import process_single;
+from hplt_textpipes.utils.jsonl_writer import JsonlWriter, dumps_line
+from hplt_textpipes.utils.lid_cache import LidCache
+from hplt_textpipes.utils.memory_usage import report_memory
+from hplt_textpipes.utils.ordered_pool import iter_batches, ordered_imap
 
-class FastTextLangId:
+class FastTextLangId(LidEngine):
     """The FastText language identification model."""
 
     def __init__(
@@ -29,6 +34,7 @@ class FastTextLangId:
         level_log: int | None = logging.INFO,
         identity: str = "openlid-v3",
         text_field: str = "t",
+        **options,
     ) -> None:
         """
         Init the FastText model.
@@ -37,53 +43,23 @@ class FastTextLangId:
         wget https://zenodo.org/records/17601701/files/openlid-v3.bin
 
         Expected usage (stdin jsonlines):
-        python -m src.hplt_textpipes.stage2.fastertext_lid.proto_langid --model_path $MODEL_PATH < $YOUR_FILE
+        python -m src.hplt_textpipes.stage3.fastertext_lid.proto_langid --identity openlid-v3 < $YOUR_FILE
 
+        The options of the prediction, e.g. script_shortcircuit, prefix_chars, segments or lid_cache, are those of
+        LidEngine.
         """
         if use_logging is True:
             self.logger = langid_logger(name=f"{identity}_langid_logger", level=level_log)
         else:
             self.logger = logging.getLogger(name=f"{identity}_langid_logger_disabled")
             self.logger.disabled = True
-        self.identity = identity
+        super().__init__(model_path, identity, **options);
         self.text_field = text_field
-        self.model = fasttext.load_model(model_path)
         self.logger.debug(f"FastTextLangId model loaded: {model_path}.")
 
-    def _preproccess_text(self, text: str) -> str:
-        """Preprocesses a single line of text for lang ID."""
-        if not isinstance(text, str):
-            msg = "Input text must be a string."
-            raise TypeError(msg)
-
-        self.logger.debug("Before: %s", text)
-        text = text.strip().replace('\n', ' ').lower()
-        text = regex.sub(SPACE_PATTERN, " ", text)
-        text = regex.sub(NONWORD_REPLACE_PATTERN, "", text)
-        self.logger.debug("After: %s", text)
-        return text
-
-    def _postprocess_predicted_labels(self, prediction: tuple) -> list[str]:
-        """
-        Postprocess the predicted labels.
-
-        Example: "__label__eng_Latn" -> "eng_Latn"
-        """
-        return [label.removeprefix("__label__") for label in prediction[0]]
-
-    def _postprocess_predicted_probabilities(self, prediction: tuple) -> list[float]:
-        """
-        Postprocess the predicted probabilities.
-
-        Example: [0.92134414] -> [0.9213]
-        """
-        rounded_probs = numpy.round(prediction[1], decimals=4)
-
-        return rounded_probs.tolist()
-
-    def predict_language_from_stdin_jsonlines(self, enrich = False) -> None:
+    def predict_language_from_stdin_jsonlines(self, enrich = False, batch_size = 1) -> None:
         """
-        Read from stdin jsonlines.
+        Read from stdin jsonlines, predicting for batch_size lines at once with predict_batch().
 
         Example input:
 
@@ -91,66 +67,112 @@ class FastTextLangId:
 
         Example output:
 
-        {"lang": ["eng_Latn"], "prob": [0.9213]}
+        {"openlid-v3": {"lang": ["eng_Latn"], "prob": [0.9213]}}
 
         """
-        with fileinput.input(files=("-",), encoding="utf-8") as f:
-            for i, fileinput_line in enumerate(f):
-                self.logger.debug("Read fileinput line: %s", fileinput_line)
-                # load json line
-                json_line = ujson.loads(fileinput_line)
-                self.logger.debug("Read json line.")
-
-                if json_line[self.text_field] is None:
-                    self.logger.debug("Case: text is None.")
-                    result = {"lang": None};
-                    if self.identity is not None:
-                        result = {self.identity: result};
-                    if enrich: result["md"] = None;
-                    print(ujson.dumps(result))
-
-                elif len(json_line[self.text_field]) == 0:
-                    self.logger.debug("Case: text is empty.")
-                    result = {"lang": None};
-                    if self.identity is not None:
-                        result = {self.identity: result};
-                    if enrich: result["md"] = None;
-                    print(ujson.dumps(result))
-
-                else:
-                    self.logger.debug("Case: text is ok.")
-                    text = json_line[self.text_field]
-                    if self.identity is None or "openlid" in self.identity:
-                        text = self._preproccess_text(text)
-                    else:
-                        text = text.replace("\n", " ")
-                    prediction = self.model.predict(
-                        text=text,
-                        k=3,
-                        threshold=0.0,
-                        on_unicode_error="strict",
-                    )
-
-                    result = { "lang": self._postprocess_predicted_labels(prediction),
-                               "prob": self._postprocess_predicted_probabilities(prediction) };
-                    if self.identity is not None:
-                        result = {self.identity: result};
-
-                    if enrich:
-                        md = None;
-                        try:
-                            xml = json_line["x"];
-                            if xml is not None:
-                                md = process_single(xml, line_num = i, raw = True);
-                        except Exception as error:
-                            print("proto_langid.py: MD extraction failure, line #{} ({})."
-                                  "".format(i, error),
-                                  file = sys.stderr, flush = True);
-
-                        result["md"] = md;
-                    print(ujson.dumps(result));
-
-        return None
+        with fileinput.input(files=("-",), encoding="utf-8") as f, JsonlWriter() as writer:
+            write_batches([self], f, enrich, batch_size, writer);
+
+
+def write_batch(models, json_lines, start, enrich, writer) -> None:
+    """
+    Write the results of all the models for a batch of json lines, the first of them is line #start of the input.
+    The texts are taken from the json lines once, the models with the same preprocessing share the preprocessed texts.
+    """
+    texts = [json_line[models[0].text_field] for json_line in json_lines];
+    preprocessed = {};
+    results = [model.predict_batch(texts, preprocessed) for model in models];
+    for model, model_results in zip(models, results):
+        if model.segments:
+            for result, segments in zip(model_results, model.predict_segments(texts, preprocessed)):
+                if segments is not None:
+                    result.update(segments);
+    for i, (json_line, text) in enumerate(zip(json_lines, texts), start):
+        if len(models) == 1 and models[0].identity is None:
+            result = results[0][i - start];
+        else:
+            result = {model.identity: model_results[i - start] for model, model_results in zip(models, results)};
+        if enrich:
+            md = None;
+            if text is not None and len(text) != 0:
+                try:
+                    xml = json_line["x"];
+                    if xml is not None:
+                        md = process_single(xml, line_num = i, raw = True);
+                except Exception as error:
+                    print("proto_langid.py: MD extraction failure, line #{} ({})."
+                          "".format(i, error),
+                          file = sys.stderr, flush = True);
+            result["md"] = md;
+        writer.write(result);
+
+
+def write_batches(models, lines, enrich, batch_size, writer) -> None:
+    start = 0;
+    while batch := list(itertools.islice(lines, batch_size)):
+        write_batch(models, [ujson.loads(line) for line in batch], start, enrich, writer);
+        start += len(batch);
+
+
+def predict_languages_from_stdin_jsonlines(models, enrich = False, batch_size = 1000) -> None:
+    """
+    Read from stdin jsonlines and write one output line with the results of all the models for each of them, keyed by
+    their identities, e.g. {"glotlid-v3": {...}, "openlid-v3": {...}}, the same as merging the outputs of
+    FastTextLangId.predict_language_from_stdin_jsonlines() for each model. The input is parsed once for all models.
+    """
+    with fileinput.input(files=("-",), encoding="utf-8") as f, JsonlWriter() as writer:
+        write_batches(models, f, enrich, batch_size, writer);
+
+
+# the models used by the pool workers, loaded in the parent process before forking the workers, so that they share the
+# pages of the weights instead of loading a private copy each
+_pool_models = None
+
+
+class _LinesWriter(list):
+    """Collects the output lines of a pool worker, see write_batch()."""
+    def write(self, obj):
+        self.append(dumps_line(obj));
+
+
+def _predict_lines(batch, enrich) -> bytes:
+    start, lines = batch;
+    writer = _LinesWriter();
+    write_batch(_pool_models, [ujson.loads(line) for line in lines], start, enrich, writer);
+    return b"".join(writer);
+
+
+def _numbered_batches(lines, batch_size):
+    start = 0;
+    for batch in iter_batches(lines, batch_size):
+        yield start, batch;
+        start += len(batch);
+
+
+def predict_languages_in_pool(models, njobs, enrich = False, batch_size = 1000) -> None:
+    """
+    The same as predict_languages_from_stdin_jsonlines() in a pool of njobs processes forked after loading the models,
+    which share the model weights copy-on-write. Only the parent process reads and writes, the order of the lines is
+    kept. At the end writes the memory usage of the processes to stderr, see report_memory(). If a worker dies, e.g.
+    killed by the OOM killer, the run fails with BrokenProcessPool instead of waiting for its batch forever.
+    """
+    global _pool_models;
+    _pool_models = models;
+    with fileinput.input(files=("-",), encoding="utf-8") as f, JsonlWriter() as writer, \
+            ProcessPoolExecutor(njobs, mp_context = multiprocessing.get_context("fork")) as pool:
+        # the workers exit normally on shutdown, running their finalizers, e.g. committing the persistent LID cache
+        submit = partial(pool.submit, partial(_predict_lines, enrich = enrich));
+        for chunk in ordered_imap(submit, _numbered_batches(f, batch_size), 2 * njobs):
+            writer.write_line(chunk);
+        report_memory("proto_langid.py");
+
+
+def resolve_model_path(identity: str, model_path: str | None = None) -> str | None:
+    """
+    Find the model file for the identity: model_path if it exists, by default in the directory of this script, then
+    in $HPLT_CACHE or ~/.cache/hplt.
+    """
+    return resolve_registered_model_path(identity, model_path, os.path.dirname(os.path.realpath(__file__)));
 
 
 if __name__ == "__main__":
@@ -162,14 +184,16 @@ if __name__ == "__main__":
     parser.add_argument(
         "--model_path",
         type=str,
+        nargs="+",
         default=None,
-        help="Path to the FastText model file.",
+        help="Path to the FastText model file, one for each identity.",
     )
     parser.add_argument(
         "--identity",
         type=str,
-        default="openlid-v3",
-        help="Type and version of LID model.",
+        nargs="+",
+        default=["openlid-v3"],
+        help="Type and version of LID model; with several ones each output line has the results of all of them.",
     )
     parser.add_argument(
         "--text_field",
@@ -177,6 +201,85 @@ if __name__ == "__main__":
         default="t",
         help="JSON field containing the text to be processed.",
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1000,
+        help="Number of lines to predict for at once, 1 predicts for each line separately.",
+    )
+    parser.add_argument(
+        "--njobs",
+        type=int,
+        default=1,
+        help="Number of processes predicting in parallel, forked after loading the models so that they share them.",
+    )
+    parser.add_argument(
+        "--script_shortcircuit",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Identities for which the texts in a script used by only one label of the model are not passed to the "
+             "model, see ScriptShortCircuit. Their results have a single label with the nominal probability 1.0 "
+             "instead of the top-3 labels with calibrated probabilities, and \"shortcut\": true.",
+    )
+    parser.add_argument(
+        "--script_min_share",
+        type=float,
+        default=0.99,
+        help="The minimal share of the letters of a text in the script to skip the model.",
+    )
+    parser.add_argument(
+        "--script_verify",
+        action="store_true",
+        help="Run the model for all texts anyway, report how often its top-1 label differs from the script.",
+    )
+    parser.add_argument(
+        "--prefix_chars",
+        type=int,
+        default=0,
+        help="Predict for the texts longer than this on their first characters, and on the full text only if the "
+             "prediction is not confident, see PrefixSampler; 0 always predicts for the full texts.",
+    )
+    parser.add_argument(
+        "--prefix_min_prob",
+        type=float,
+        default=0.9,
+        help="The minimal top-1 probability of the prediction for the prefix not to predict for the full text.",
+    )
+    parser.add_argument(
+        "--prefix_sample_lines",
+        type=int,
+        default=0,
+        help="Also predict for this many lines spread over the long texts, the full text is predicted for if the "
+             "top-1 labels for the prefix and the lines differ.",
+    )
+    parser.add_argument(
+        "--segments",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Identities for which the top-1 language and probability of each line of the texts are also written, "
+             "in the seg_lang and seg_prob arrays.",
+    )
+    parser.add_argument(
+        "--lid_cache",
+        type=int,
+        default=0,
+        help="Number of results of each process to keep in memory for the texts seen before, see LidCache; "
+             "0 disables the cache.",
+    )
+    parser.add_argument(
+        "--lid_cache_path",
+        type=str,
+        default=None,
+        help="SQLite database to also store the results in, shared by runs and processes.",
+    )
+    parser.add_argument(
+        "--lid_cache_mb",
+        type=int,
+        default=1024,
+        help="The maximum size of the results in the database, the least recently used are evicted.",
+    )
     parser.add_argument(
         "--use_logging",
         type=bool,
@@ -193,30 +296,47 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
-
-    model = args.model_path;
-    if model is None:
-        base = os.path.dirname(os.path.realpath(__file__));
-        model = os.path.join(base, args.identity + ".bin");
-    if not os.path.isfile(model):
-        if 'HPLT_CACHE' in os.environ:
-            # Retrieve the value from the env variable
-            base = os.environ['HPLT_CACHE']
-        else:
-            base = os.path.join(Path.home(), ".cache", "hplt")
-        model = os.path.join(base, args.identity + ".bin")
-    if not os.path.isfile(model):
-        print("proto_langid.py: missing model file for {}; exit."
-              "".format(args.identity),
-              file = sys.stderr);
-        sys.exit(1);
-        
-    loaded_model = FastTextLangId(
-        model_path=model,
-        use_logging=args.use_logging,
-        level_log=logging.getLevelName(args.log_level),
-        identity = args.identity,
-        text_field = args.text_field,
-    )
-
-    loaded_model.predict_language_from_stdin_jsonlines(args.enrich);
+    if args.model_path is not None and len(args.model_path) != len(args.identity):
+        parser.error("--model_path should be given for each --identity");
+
+    lid_cache = LidCache(args.lid_cache, args.lid_cache_path, args.lid_cache_mb) \
+        if args.lid_cache or args.lid_cache_path else None;
+    models = [];
+    for i, identity in enumerate(args.identity):
+        model = resolve_model_path(identity, None if args.model_path is None else args.model_path[i]);
+        if model is None:
+            print("proto_langid.py: missing model file for {}; exit."
+                  "".format(identity),
+                  file = sys.stderr);
+            sys.exit(1);
+
+        models.append(FastTextLangId(
+            model_path=model,
+            use_logging=args.use_logging,
+            level_log=logging.getLevelName(args.log_level),
+            identity = identity,
+            text_field = args.text_field,
+            script_shortcircuit = identity in args.script_shortcircuit,
+            script_min_share = args.script_min_share,
+            script_verify = args.script_verify,
+            prefix_chars = args.prefix_chars,
+            prefix_min_prob = args.prefix_min_prob,
+            prefix_sample_lines = args.prefix_sample_lines,
+            segments = identity in args.segments,
+            lid_cache = lid_cache,
+        ))
+
+    if args.njobs > 1:
+        predict_languages_in_pool(models, args.njobs, args.enrich, args.batch_size);
+    elif len(models) == 1:
+        models[0].predict_language_from_stdin_jsonlines(args.enrich, args.batch_size);
+    else:
+        predict_languages_from_stdin_jsonlines(models, args.enrich, args.batch_size);
+    for model in models:
+        if model.script_filter is not None:
+            model.script_filter.report("proto_langid.py: {}".format(model.identity));
+        if model.prefix_sampler is not None:
+            model.prefix_sampler.report("proto_langid.py: {}".format(model.identity));
+    if lid_cache is not None:
+        lid_cache.close();
+        lid_cache.report("proto_langid.py");
@@ -13,8 +13,7 @@ TMP_DIR="$OUTPUT_DIR"/tmp
 mkdir -p "$OUTPUT_DIR" "$TMP_DIR"
 
 # intermediate files
-FL1="$TMP_DIR/l1"
-FL2="$TMP_DIR/l2"
+FLID="$TMP_DIR/lid"
 FHTMLMETA="$TMP_DIR/htmlmeta"
 
 
@@ -64,31 +63,24 @@ TMP_DIR="$OUTPUT_DIR"/tmp
 mkdir -p "$OUTPUT_DIR" "$TMP_DIR"
 
 # intermediate files
-FL1="$TMP_DIR/l1"
-FL2="$TMP_DIR/l2"
+FLID="$TMP_DIR/lid"
 FHTMLMETA="$TMP_DIR/htmlmeta"
 
 
 NJOBS=$(( NJOBS - 2 ))  # leave 2 for non-cpu-intensive and auxiliary processes
-# step1: 30% xml2md, 70% glotlid
+# 30% xml2md, 70% glotlid and openlid
 MDJOBS=$(( NJOBS * 3 / 10 )); (( MDJOBS < 1 )) && MDJOBS=1
-GLJOBS=$(( NJOBS - MDJOBS )); (( GLJOBS < 1 )) && GLJOBS=1
-# step2: 3 for compression, rest openlid
-OLJOBS=$(( NJOBS - 3 )); (( OLJOBS < 1 )) && OLJOBS=1
+LIDJOBS=$(( NJOBS - MDJOBS )); (( LIDJOBS < 1 )) && LIDJOBS=1
 
-LID_BLOCKSIZE=10M  # the block size selected for OpenLID in stage2; 
 XML2MD_BLOCKSIZE=30M # use smaller block for xml2md.py as it takes less time to initiate
 
-run_lid_parallel() {
-    # --keep-order guarantees that GNU Parallel will collect stdout from tasks and print it to its stdout in the order
-    # aligned with the order of input lines
-    # --block issues one task per block of input lines of roughly this size, but without breaking lines;
-    # making it too small will increase extra costs on script initialization (e.e. weights loading for langid),
-    # making it too large will require buffering too much outputs in parallel due to --keep-order requirement.
+run_lid_pool() {
+    # one process loads all the models once, then forks the workers, which share the weights instead of loading
+    # a private copy each; this allows running glotlid and openlid in one pass over the texts without the risk of OOM;
+    # the parent process sends batches of lines to the workers and writes the outputs in the order of the input lines
     printf "started %s in %s processes\n" "${2}" "${1}" 1>&2
     time_start=$(date +%s.%N)
-    parallel --halt now,fail=1 --block $LID_BLOCKSIZE -j "${1}" --pipe --keep-order  \
-            "python -m hplt_textpipes.stage3.fastertext_lid.proto_langid --identity ${2} --text_field ${3}"
+    python -m hplt_textpipes.stage3.fastertext_lid.proto_langid --identity ${2} --text_field ${3} --njobs "${1}"
     time_end=$(date +%s.%N)
     printf "%.3fs: finished %s in %s processes\n" "$(echo "$time_end - $time_start" | bc)" "${2}" "${1}" 1>&2
 }
@@ -107,10 +99,10 @@ compress_file() {
     t2sz "${1}" -s 512K -l 3 -o "${2}"
 }
 
-# Run xml2md and glotlid in background, and mexdemux in foreground: text.zst -> l2, xml, text, md, htmllang
-mkfifo "$TMP_DIR/pipe_l2"
-run_lid_parallel $GLJOBS glotlid-v3 text <"$TMP_DIR/pipe_l2" >"$FL2"  &
-PID_L2=$!
+# Run xml2md and LID in background, and mexdemux in foreground: text.zst -> lid, xml, text, md, htmllang
+mkfifo "$TMP_DIR/pipe_lid"
+run_lid_pool $LIDJOBS "glotlid-v3 openlid-v3" text <"$TMP_DIR/pipe_lid" >"$FLID"  &
+PID_LID=$!
 
 mkfifo "$TMP_DIR/pipe_md"
 run_xml2md_parallel $MDJOBS <"$TMP_DIR/pipe_md" >"$TMP_DIR/md"  &
@@ -122,7 +114,7 @@ python -m hplt_textpipes.utils.jsonl_muxdemux \
     <(rclone cat "$INPUT_DIR/text.zst" | zstdcat) \
     $ALLOWED_PIPE \
     -- \
-    "$TMP_DIR/pipe_l2" text=t \
+    "$TMP_DIR/pipe_lid" text=t \
     $TMP_DIR/xml xml=x \
     $TMP_DIR/text text=t \
     "$FHTMLMETA" htmllang,metalang,tagfilter  \
@@ -139,15 +131,11 @@ for f in xml md text; do
     pids+=("$!")
 done
 
-# NB! this results is a delay, but we risk OOM if running many openlids before all glotlids finished
-echo $(date +"%T") waiting for background glotlid processes  1>&2
-wait $PID_L2
+echo $(date +"%T") waiting for background LID processes  1>&2
+wait $PID_LID
 
-echo $(date +"%T") step2: running openlid  1>&2
-run_lid_parallel $OLJOBS openlid-v3 text <"$TMP_DIR/text" >"$FL1"
-
-# step3 collects all metadata
-echo $(date +"%T") step3: starting jsonl_muxdemux  1>&2
+# step2 collects all metadata
+echo $(date +"%T") step2: starting jsonl_muxdemux  1>&2
 # the first muxdemux will filter yet unfiltered lang.zst and metadata.zst with allowed.zst
 stream_allowed_if_exists
 python -m hplt_textpipes.utils.jsonl_muxdemux \
@@ -159,8 +147,7 @@ python -m hplt_textpipes.utils.jsonl_muxdemux \
 | python -m hplt_textpipes.utils.jsonl_muxdemux \
     - \
     "$FHTMLMETA" \
-    "$FL2" \
-    "$FL1" \
+    "$FLID" \
     -- \
     $TMP_DIR/metadata '*'
 
@@ -0,0 +1,66 @@
+"""
+Buffered output of jsonlines serialized with orjson.
+"""
+import json
+import sys
+
+import orjson
+
+
+def dumps_line(obj) -> bytes:
+    """
+    Serializes obj to a jsonline (including the trailing newline) with orjson. orjson rejects strings with lone
+    surrogates which may appear in texts extracted from HTMLs with such escapes, these are serialized with the standard
+    json module escaping them.
+    """
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    except TypeError:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class JsonlWriter:
+    """
+    Writes jsonlines to a binary stream (sys.stdout.buffer by default) in large chunks. Lines are copied into a buffer
+    allocated once and written when it is full, or when flush() or close() is called. Lines larger than the buffer are
+    written directly. The stream itself is flushed only by flush() and close(), flushing e.g. a zstd compressor after
+    each chunk would make it wait for its threads.
+    """
+    def __init__(self, stream=None, buffer_size=4 * 2**20):
+        self.stream = sys.stdout.buffer if stream is None else stream
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.pos = 0
+
+    def write(self, obj):
+        """Serializes obj with dumps_line() and writes it."""
+        self.write_line(dumps_line(obj))
+
+    def write_line(self, line: bytes):
+        """Writes an already serialized jsonline, it should end with the newline."""
+        n = len(line)
+        if self.pos + n > len(self.buffer):
+            self._write_buffer()
+            if n > len(self.buffer):
+                self.stream.write(line)
+                return
+        self.view[self.pos:self.pos + n] = line
+        self.pos += n
+
+    def _write_buffer(self):
+        if self.pos:
+            self.stream.write(self.view[:self.pos])
+            self.pos = 0
+
+    def flush(self):
+        self._write_buffer()
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,139 @@
+"""
+Cache of LID results for the texts seen before, e.g. near-duplicates and boilerplate repeated across crawls: a bounded
+LRU in each process in front of an optional persistent ResultCache shared by runs and processes. Keys are xxh128
+digests of the model identity and the preprocessed text, so the results of different models never match.
+"""
+import multiprocessing
+import multiprocessing.util
+import os
+import sys
+from collections import OrderedDict
+
+import orjson
+from xxhash import xxh3_128
+
+from hplt_textpipes.utils.result_cache import ResultCache
+
+
+class LidCache:
+    """
+    Maps (identity, preprocessed text) to the result of the model, a json-serializable object such as
+    {"lang": [...], "prob": [...]}. The results are stored serialized, so every lookup returns a new object which the
+    caller may modify. The identity should identify everything apart from the text that affects the results, e.g.
+    include the number of labels predicted.
+
+    :param max_entries: the number of results kept in the LRU of each process
+    :param path: the SQLite database of the persistent store, see ResultCache; it is opened in each process when
+    first used, so the cache may be created before forking pool workers. Lookups in it are read-only, the new results
+    and the hits are kept in memory and written in one short transaction once there are ResultCache.COMMIT_EVERY of
+    them and on close(), so that a process neither commits for each call nor holds the lock of the database while
+    the model runs between the calls; results not yet written are lost if the process is killed
+    :param max_mb: the maximum size of the results in the persistent store
+    :param counts: the counters of lookups, hits in the LRU, hits in the persistent store and stored results, pass the
+    counts of another instance to share them between processes
+    """
+    def __init__(self, max_entries: int = 100000, path: str = None, max_mb: int = 1024, counts=None) -> None:
+        self.max_entries = max_entries
+        self.path = path
+        self.max_bytes = max_mb * 2**20
+        self.lru = OrderedDict()
+        self.counts = multiprocessing.Array('q', 4) if counts is None else counts
+        self._store = None
+        self._store_pid = None
+        self._pending = {}  # the results to write to the persistent store
+        self._touched = []  # the keys found in the persistent store to mark as recently used
+
+    @staticmethod
+    def key(identity: str, text: str) -> bytes:
+        h = xxh3_128(identity.encode('utf-8'))
+        h.update(b'\0')
+        h.update(text.encode('utf-8', errors='surrogatepass'))
+        return h.digest()
+
+    def store(self) -> ResultCache | None:
+        """The persistent store opened in this process, or None if there is no persistent store."""
+        if self.path is None:
+            return None
+        if self._store_pid != os.getpid():
+            # a connection inherited from the parent process must not be used after forking
+            self._store = ResultCache(self.path, self.max_bytes)
+            self._store_pid = os.getpid()
+            self._pending, self._touched = {}, []
+            # commits the last results when a pool worker exits normally, e.g. after Pool.close() and Pool.join()
+            multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+        return self._store
+
+    def get_many(self, identity: str, texts: list[str]) -> tuple[list[bytes], list]:
+        """Returns the keys of the texts and the results cached for them, None for those not found."""
+        keys = [self.key(identity, text) for text in texts]
+        results = [None] * len(keys)
+        lru_hits = store_hits = 0
+        store = self.store()
+        for i, key in enumerate(keys):
+            if (value := self.lru.get(key)) is not None:
+                self.lru.move_to_end(key)
+                lru_hits += 1
+            elif (value := self._pending.get(key)) is not None:
+                self._remember(key, value)
+                lru_hits += 1
+            elif store is not None and (value := store.get(key, touch=False)) is not None:
+                self._remember(key, value)
+                self._touched.append(key)
+                store_hits += 1
+            if value is not None:
+                results[i] = orjson.loads(value)
+        self._maybe_flush()
+        self._count(len(keys), lru_hits, store_hits, 0)
+        return keys, results
+
+    def put_many(self, keys: list[bytes], results: list) -> None:
+        store = self.store()
+        for key, result in zip(keys, results):
+            value = orjson.dumps(result)
+            self._remember(key, value)
+            if store is not None:
+                self._pending[key] = value
+        self._maybe_flush()
+        self._count(0, 0, 0, len(keys))
+
+    def _maybe_flush(self):
+        if len(self._pending) + len(self._touched) >= ResultCache.COMMIT_EVERY:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the pending results and hits to the persistent store of this process and commits."""
+        store = self.store()
+        if store is None:
+            return
+        for key in self._touched:
+            store.touch(key)
+        for key, value in self._pending.items():
+            store.put(key, value)
+        store.commit()
+        self._pending, self._touched = {}, []
+
+    def _remember(self, key, value):
+        self.lru[key] = value
+        if len(self.lru) > self.max_entries:
+            self.lru.popitem(last=False)
+
+    def _count(self, *counts):
+        with self.counts.get_lock():
+            for i, n in enumerate(counts):
+                self.counts[i] += n
+
+    def close(self) -> None:
+        """Writes the pending results, commits and closes the persistent store of this process."""
+        if self._store is not None and self._store_pid == os.getpid():
+            self.flush()
+            self._store.close()
+        self._store = self._store_pid = None
+
+    def report(self, name: str) -> None:
+        """Writes the hit rates over all processes sharing the counts to stderr."""
+        lookups, lru_hits, store_hits, stored = self.counts
+        hits = lru_hits + store_hits
+        msg = f'{name}: LID cache hits {hits}/{lookups} ({hits / max(lookups, 1):.1%}), {lru_hits} in memory'
+        if self.path is not None:
+            msg += f' and {store_hits} in {self.path}'
+        print(f'{msg}, stored {stored}', file=sys.stderr)
@@ -0,0 +1,39 @@
+"""
+Memory usage of a process and its pool workers read from /proc/<pid>/smaps_rollup (Linux). The workers forked after
+loading a model share its pages with the parent process until any of them writes there, so RSS counts the model
+in every worker while PSS divides the shared pages between the processes sharing them; the sum of PSS over the
+processes is the memory they actually take together.
+"""
+import multiprocessing
+import sys
+
+SMAPS_FIELDS = ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty')
+
+
+def memory_usage(pid='self'):
+    """Returns RSS, PSS and private memory of the process in MB, or None if /proc/<pid>/smaps_rollup is not available."""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    kb = {}
+    for l in lines:
+        name, _, value = l.partition(':')
+        if name in SMAPS_FIELDS:
+            kb[name] = int(value.split()[0])
+    return {'rss_MB': kb['Rss'] / 1024, 'pss_MB': kb['Pss'] / 1024,
+            'private_MB': (kb['Private_Clean'] + kb['Private_Dirty']) / 1024}
+
+
+def report_memory(name):
+    """Writes to stderr the memory usage of this process, of each of its live child processes and the total PSS."""
+    procs = [('main', 'self')] + [(f'worker {p.pid}', p.pid) for p in multiprocessing.active_children()]
+    total_pss = 0
+    for label, pid in procs:
+        if (usage := memory_usage(pid)) is None:
+            continue
+        total_pss += usage['pss_MB']
+        print(f'{name}: {label} RSS {usage["rss_MB"]:.0f} MB, PSS {usage["pss_MB"]:.0f} MB, '
+              f'private {usage["private_MB"]:.0f} MB', file=sys.stderr)
+    print(f'{name}: total PSS of {len(procs)} processes {total_pss:.0f} MB', file=sys.stderr)
@@ -0,0 +1,77 @@
+"""
+Helpers for processing a stream of batches in a pool of workers while keeping the outputs in the input order.
+"""
+import itertools
+import threading
+from collections import deque
+
+
+def iter_batches(iterable, batch_size):
+    """Splits an iterable into lists of at most batch_size consecutive items."""
+    it = iter(iterable)
+    while batch := list(itertools.islice(it, batch_size)):
+        yield batch
+
+
+def ordered_imap(submit, batches, max_pending):
+    """
+    Submits each batch with submit(batch) and yields results in the order the batches were submitted.
+    Unlike multiprocessing.Pool.imap(), which reads the whole input eagerly, at most max_pending batches are in flight
+    at any moment. This bounds the memory required to buffer the results that are ready but cannot be written yet
+    because some earlier batch is still being processed.
+
+    :param submit: a function returning concurrent.futures.Future,
+    e.g. functools.partial(executor.submit, f) or WatchdogPool.submit
+    :param batches: an iterable of batches
+    :param max_pending: the maximum number of submitted batches which results are not yielded yet
+    """
+    pending = deque()
+    for batch in batches:
+        pending.append(submit(batch))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class ReorderBuffer:
+    """
+    Collects items numbered with consecutive sequence numbers, which may arrive in any order and from any thread,
+    and releases them in the order of their numbers.
+    """
+    def __init__(self):
+        self.next = 0  # the sequence number of the next item to release
+        self._items = {}
+        self._error = None
+        self._cond = threading.Condition()
+
+    def put(self, seq, item):
+        with self._cond:
+            self._items[seq] = item
+            self._cond.notify()
+
+    def fail(self, error):
+        """Makes the following calls of pop_ready() and pop_next() raise the error, e.g. from a failed worker."""
+        with self._cond:
+            self._error = error
+            self._cond.notify()
+
+    def pop_ready(self):
+        """Returns the list of items that can be released without waiting."""
+        res = []
+        with self._cond:
+            if self._error is not None:
+                raise self._error
+            while self.next in self._items:
+                res.append(self._items.pop(self.next))
+                self.next += 1
+        return res
+
+    def pop_next(self):
+        """Waits for the next item and returns it."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.next in self._items or self._error is not None)
+            if self._error is not None:
+                raise self._error
+            self.next += 1
+            return self._items.pop(self.next - 1)
@@ -0,0 +1,129 @@
+"""
+On-disk cache for results of expensive per-document processing, keyed by hashes of the inputs.
+"""
+import sqlite3
+import sys
+import threading
+from collections import Counter
+
+from xxhash import xxh3_128
+
+
+class ResultCache:
+    """
+    A size-bounded key-value store in a SQLite database, so that several runs and processes can share it without any
+    service. Keys are xxh128 digests of the inputs, values are bytes. When the total size of the values exceeds
+    max_bytes, the least recently used entries are evicted down to 90% of max_bytes. Values larger than 10% of max_bytes
+    are not stored.
+    The total size is kept in the database and updated in the transaction of each put and eviction, so the limit
+    holds for all the processes sharing the database rather than for each of them.
+    Entries made with different namespaces never match, the namespace should identify everything apart from the input
+    that affects the results, e.g. the version of the library and the options used.
+    The methods can be called from any thread.
+    """
+    COMMIT_EVERY = 1000
+
+    def __init__(self, path, max_bytes, namespace=''):
+        self.max_bytes = max_bytes
+        self.namespace = xxh3_128(namespace.encode('utf-8')).digest()
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=OFF')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cache (key BLOB PRIMARY KEY, value BLOB, used INTEGER)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER)')
+        self._conn.execute('INSERT OR IGNORE INTO size SELECT 0, COALESCE(SUM(LENGTH(value)), 0) FROM cache')
+        self._conn.commit()
+        self._total, self._clock = self._conn.execute(
+            'SELECT (SELECT total FROM size), COALESCE(MAX(used), 0) FROM cache').fetchone()
+        self._uncommitted = 0
+
+    def key(self, data: bytes) -> bytes:
+        h = xxh3_128(self.namespace)
+        h.update(data)
+        return h.digest()
+
+    def get(self, key, touch=True):
+        """
+        Returns the value stored for the key or None. Marks the entry as recently used unless touch is False, which
+        makes the lookup read-only, so that it does not start a write transaction; call touch() later in that case.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM cache WHERE key=?', (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            if touch:
+                self._touch(key)
+            return row[0]
+
+    def touch(self, key):
+        """Marks the entry for the key, if any, as recently used."""
+        with self._lock:
+            self._touch(key)
+
+    def _touch(self, key):
+        self._clock += 1
+        self._conn.execute('UPDATE cache SET used=? WHERE key=?', (self._clock, key))
+        self._maybe_commit()
+
+    def put(self, key, value: bytes):
+        if len(value) > self.max_bytes // 10:
+            return  # storing it would evict too many other entries
+        with self._lock:
+            self._clock += 1
+            # the update starts the write transaction, which no other process can change before the commit, so the
+            # total read back includes the puts of the other processes
+            self._conn.execute('UPDATE size SET total = total + ? - COALESCE((SELECT LENGTH(value) FROM cache '
+                               'WHERE key=?), 0)', (len(value), key))
+            self._conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', (key, value, self._clock))
+            self._total = self._conn.execute('SELECT total FROM size').fetchone()[0]
+            self.stats['puts'] += 1
+            if self._total > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self._maybe_commit()
+
+    def _evict(self, target):
+        evicted, evicted_size = [], 0
+        for key, size in self._conn.execute('SELECT key, LENGTH(value) FROM cache ORDER BY used'):
+            if self._total <= target:
+                break
+            evicted.append((key,))
+            evicted_size += size
+            self._total -= size
+        self._conn.executemany('DELETE FROM cache WHERE key=?', evicted)
+        self._conn.execute('UPDATE size SET total = total - ?', (evicted_size,))
+        self.stats['evicted'] += len(evicted)
+
+    def commit(self):
+        """Commits now, releasing the lock of the database held since the last commit for other processes using it."""
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def _maybe_commit(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def report(self, name):
+        """Writes the hit/miss counters to stderr."""
+        lookups = self.stats['hits'] + self.stats['misses']
+        print(f'{name}: cache hits {self.stats["hits"]}/{lookups} ({self.stats["hits"] / max(lookups, 1):.1%}), '
+              f'stored {self.stats["puts"]}, evicted {self.stats["evicted"]}, size {self._total / 2**20:.1f}MB',
+              file=sys.stderr)
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
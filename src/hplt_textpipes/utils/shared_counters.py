@@ -0,0 +1,56 @@
+"""
+Counters shared by the processes of a pool without taking a lock for each update.
+"""
+import multiprocessing
+import os
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedCounters:
+    """
+    A vector of counters summed over processes: each process adds to its own slot of a shared array with no lock, the
+    totals are the sums over the slots. A lock is taken only to claim a slot, once per process, see claim(). Workers
+    killed while updating the counters, e.g. by WatchdogPool, cannot leave a lock held that would block the others, and
+    the updates of the workers do not contend. A new process takes over the slot of a dead one, keeping its counts,
+    so max_processes bounds the processes alive at the same time rather than all those started.
+    Create the counters before forking the workers, call claim() in each of them before they may be killed, e.g. in
+    the initializer of the pool.
+
+    :param typecode: the type of the counters, 'q' or 'd', see multiprocessing.RawArray
+    :param size: the number of counters
+    """
+    def __init__(self, typecode, size, max_processes=1024):
+        self.size = size
+        self.values = multiprocessing.RawArray(typecode, size * max_processes)
+        self.owners = multiprocessing.Array('q', max_processes)  # the pid of the process owning each slot or 0
+        self._pid, self._base = None, None
+
+    def claim(self):
+        """Claims a slot for the current process unless it has one, returns the index of its first counter."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._base
+        with self.owners.get_lock():
+            slot = next((i for i, owner in enumerate(self.owners) if owner in (0, pid) or not _alive(owner)), None)
+            if slot is None:
+                raise RuntimeError(f'No free slot among {len(self.owners)} for the counters of process {pid}')
+            self.owners[slot] = pid
+        self._pid, self._base = pid, slot * self.size
+        return self._base
+
+    def add(self, i, n=1):
+        base = self._base if self._pid == os.getpid() else self.claim()
+        self.values[base + i] += n
+
+    def totals(self):
+        values = self.values[:]
+        return [sum(values[i::self.size]) for i in range(self.size)]
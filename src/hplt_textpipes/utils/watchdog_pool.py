@@ -0,0 +1,185 @@
+"""
+A process pool which kills and restarts workers that spend too much time processing a single item.
+"""
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+
+class _Task:
+    def __init__(self, items):
+        self.items = items
+        self.results = []
+        self.future = Future()
+
+    def done(self):
+        return len(self.results) == len(self.items)
+
+
+class _Worker:
+    def __init__(self, ctx, func, initializer, initargs):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_loop, args=(child_conn, func, initializer, initargs), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False  # the worker sends a message when the initializer has finished
+        self.task = None
+        self.deadline = None
+
+
+def _worker_loop(conn, func, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+    conn.send(None)
+    while (items := conn.recv()) is not None:
+        for item in items:
+            conn.send(func(item))
+
+
+class WatchdogPool:
+    """
+    Processes batches of items in a pool of worker processes. Each worker gets a batch and sends back the result of
+    func(item) for each item in it. If a worker does not return the result for an item within the timeout, it is killed,
+    the result for this item is replaced with on_timeout(item), a new worker is started and continues with the rest of
+    the batch. Unlike time limits based on signals, this works for any code running in the workers, including threads
+    and C extensions that do not check for signals.
+    A worker dying for any other reason is considered an unrecoverable error which is set as the exception of the future
+    for its batch.
+    Workers are forked, like in the other pools of the pipeline, so that they share the pages of the models loaded
+    before the pool is created, and a restarted worker does not reload what the parent already has.
+    """
+    def __init__(self, njobs, func, timeout, on_timeout, initializer=None, initargs=()):
+        self.func, self.timeout, self.on_timeout = func, timeout, on_timeout
+        self.initializer, self.initargs = initializer, initargs
+        self.ctx = multiprocessing.get_context('fork')
+        self.killed = 0
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._error = None
+        self._wakeup_r, self._wakeup_w = self.ctx.Pipe(duplex=False)
+        self._workers = [self._spawn() for _ in range(njobs)]
+        self._thread = threading.Thread(target=self._manage, daemon=True)
+        self._thread.start()
+
+    def _spawn(self):
+        return _Worker(self.ctx, self.func, self.initializer, self.initargs)
+
+    def submit(self, items):
+        """Schedules a batch of items, returns concurrent.futures.Future with the list of results."""
+        task = _Task(items)
+        if not items:
+            task.future.set_result([])
+            return task.future
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            self._queue.append(task)
+        self._wakeup_w.send(None)
+        return task.future
+
+    def _dispatch(self):
+        now = time.monotonic()
+        for w in self._workers:
+            if w.task is not None or not w.ready:
+                continue
+            with self._lock:
+                if not self._queue:
+                    return
+                w.task = self._queue.popleft()
+            w.conn.send(w.task.items[len(w.task.results):])
+            w.deadline = now + self.timeout
+
+    def _receive(self, w):
+        try:
+            res = w.conn.recv()
+        except EOFError:
+            w.process.join()
+            exc = RuntimeError(f'Worker process {w.process.pid} died with exit code {w.process.exitcode}')
+            if not w.ready:
+                raise exc  # the initializer failed, restarting the worker will not help
+            if w.task is not None:
+                w.task.future.set_exception(exc)
+                w.task = None
+            self._replace(w, requeue=False)
+            return
+        if not w.ready:
+            w.ready = True
+            return
+        w.task.results.append(res)
+        w.deadline = time.monotonic() + self.timeout
+        if w.task.done():
+            w.task.future.set_result(w.task.results)
+            w.task = None
+
+    def _replace(self, w, requeue):
+        w.process.kill()
+        w.process.join()
+        w.conn.close()
+        task = w.task
+        self._workers[self._workers.index(w)] = self._spawn()
+        if requeue and task is not None:
+            if task.done():
+                task.future.set_result(task.results)
+            else:
+                # the rest of the batch goes first to keep the batches being finished in order of their submission
+                with self._lock:
+                    self._queue.appendleft(task)
+
+    def _manage(self):
+        try:
+            self._manage_loop()
+        except BaseException as e:
+            with self._lock:
+                self._error = e
+                tasks = list(self._queue) + [w.task for w in self._workers if w.task is not None]
+                self._queue.clear()
+            for task in tasks:
+                task.future.set_exception(e)
+
+    def _manage_loop(self):
+        while True:
+            self._dispatch()
+            busy = {w.conn: w for w in self._workers if w.task is not None or not w.ready}
+            if self._closed and not self._queue and all(w.task is None for w in self._workers):
+                return
+            deadlines = [w.deadline for w in busy.values() if w.task is not None]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            for conn in wait(list(busy) + [self._wakeup_r], timeout):
+                if conn is self._wakeup_r:
+                    self._wakeup_r.recv()
+                else:
+                    self._receive(busy[conn])
+
+            now = time.monotonic()
+            for w in list(self._workers):
+                if w.task is not None and w.deadline <= now and not w.conn.poll():
+                    w.task.results.append(self.on_timeout(w.task.items[len(w.task.results)]))
+                    self.killed += 1
+                    self._replace(w, requeue=True)
+
+    def close(self):
+        """Waits for all submitted batches to be processed and stops the workers."""
+        self._closed = True
+        self._wakeup_w.send(None)
+        self._thread.join()
+        for w in self._workers:
+            if self._error is None:
+                w.conn.send(None)
+            else:
+                w.process.kill()
+            w.process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for w in self._workers:
+                w.process.kill()
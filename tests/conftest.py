@@ -0,0 +1,24 @@
+import fasttext
+import pytest
+
+LID_TRAINING = [
+    ('eng_Latn', 'the cat sat on the mat and looked at the dog'),
+    ('eng_Latn', 'this is a sentence in english with some words'),
+    ('fra_Latn', 'le chat est assis sur le tapis et regarde le chien'),
+    ('fra_Latn', 'ceci est une phrase en francais avec quelques mots'),
+    ('deu_Latn', 'die katze sitzt auf der matte und schaut den hund an'),
+    ('deu_Latn', 'das ist ein satz auf deutsch mit einigen woertern'),
+    ('kat_Geor', 'ეს არის წინადადება ქართულ ენაზე რამდენიმე სიტყვით'),
+]
+
+
+@pytest.fixture(scope='session')
+def lid_model(tmp_path_factory):
+    """A tiny FastText LID model, for the tests of the LID plumbing rather than of its predictions."""
+    tmp = tmp_path_factory.mktemp('lid')
+    train = tmp / 'train.txt'
+    train.write_text(''.join(f'__label__{label} {text}\n' for label, text in LID_TRAINING * 10), encoding='utf-8')
+    model = fasttext.train_supervised(input=str(train), dim=10, epoch=5, minCount=1, thread=1, verbose=0)
+    path = tmp / 'lid.bin'
+    model.save_model(str(path))
+    return str(path)
@@ -0,0 +1,93 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+import zstandard
+
+from hplt_textpipes.bench.traf import read_corpus
+
+
+def forked_children(pid):
+    """
+    The processes forked by pid: its children running the same command line, e.g. the workers of its pools, in the
+    order they were started.
+    """
+    with open(f'/proc/{pid}/cmdline', 'rb') as f:
+        cmdline = f.read()
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                if int(fields[1]) == pid and f.read() == cmdline:
+                    children.append((int(fields[19]), int(entry)))
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return [child for _, child in sorted(children)]
+
+
+def _write_and_close(stream, lines):
+    try:
+        stream.writelines(lines)
+        stream.close()
+    except (BrokenPipeError, ValueError):
+        pass
+
+
+def run_and_kill_worker(cmd, lines, nworkers, timeout=120):
+    """
+    Runs cmd with the first lines on stdin, kills the last started of its workers with SIGKILL once nworkers are
+    running, then writes the other lines and returns the exit code; fails if the process does not exit within timeout seconds.
+    """
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        half = len(lines) // 2
+        proc.stdin.writelines(lines[:half])
+        proc.stdin.flush()
+        deadline = time.monotonic() + timeout
+        while len(workers := forked_children(proc.pid)) < nworkers:
+            assert proc.poll() is None and time.monotonic() < deadline, 'the workers did not start'
+            time.sleep(0.1)
+        os.kill(workers[-1], signal.SIGKILL)
+        # a hanging process stops reading its input, so it is written by a thread not to block the wait
+        threading.Thread(target=_write_and_close, args=(proc.stdin, lines[half:]), daemon=True).start()
+        return proc.wait(timeout)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+@pytest.mark.parametrize('timeout_engine', ['signal', 'watchdog'])
+def test_traf_dead_worker(timeout_engine):
+    lines = read_corpus(None, 200)
+    cmd = [sys.executable, '-m', 'hplt_textpipes.stage2.trafilatura.traf', '--njobs', '2', '--batch_size', '1',
+           '--timeout_engine', timeout_engine]
+    assert run_and_kill_worker(cmd, lines, 2) != 0
+
+
+def test_run_dead_lid_worker(lid_model):
+    # the LID worker is started after the 2 Trafilatura workers, once the first batch of texts is extracted
+    data = zstandard.compress(b''.join(read_corpus(None, 200)))
+    chunks = [data[i:i + 4096] for i in range(0, len(data), 4096)]
+    with tempfile.TemporaryDirectory() as outdir:
+        cmd = [sys.executable, '-m', 'hplt_textpipes.stage2.run', '--fin=-', outdir, '--njobs', '3', '--lid_njobs', '1',
+               '--batch_size', '1', '--lid_batch_size', '5', '--lid_model', lid_model]
+        assert run_and_kill_worker(cmd, chunks, 3) != 0
+
+
+def test_stage3_lid_dead_worker(lid_model):
+    lines = [json.dumps({'t': f'the cat sat on the mat {i}\nle chat est assis sur le tapis'}).encode() + b'\n'
+             for i in range(2000)]
+    cmd = [sys.executable, '-m', 'hplt_textpipes.stage3.fastertext_lid.proto_langid', '--identity', 'openlid-v3',
+           '--model_path', lid_model, '--njobs', '2', '--batch_size', '1']
+    assert run_and_kill_worker(cmd, lines, 2) != 0
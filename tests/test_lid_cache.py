@@ -0,0 +1,42 @@
+import sqlite3
+
+from hplt_textpipes.utils.lid_cache import LidCache
+from hplt_textpipes.utils.result_cache import ResultCache
+
+
+def stored(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+def test_store_written_in_batches(tmp_path):
+    path = str(tmp_path / 'lid.sqlite')
+    cache = LidCache(path=path)
+    for i in range(10):
+        keys, results = cache.get_many('model', [f'text {i}'])
+        assert results == [None]
+        cache.put_many(keys, [{'lang': ['eng'], 'prob': [1.0]}])
+    assert stored(path) == 0
+    # the cache holds no write transaction between the calls, other processes can write
+    with sqlite3.connect(path, timeout=0.1) as conn:
+        conn.execute('UPDATE size SET total = total')
+    cache.close()
+    assert stored(path) == 10
+
+    cache = LidCache(path=path)
+    keys, results = cache.get_many('model', [f'text {i}' for i in range(10)])
+    assert results == [{'lang': ['eng'], 'prob': [1.0]}] * 10
+    assert list(cache.counts) == [10, 0, 10, 0]
+    cache.close()
+
+
+def test_store_flushed_every_commit_every(tmp_path, monkeypatch):
+    monkeypatch.setattr(ResultCache, 'COMMIT_EVERY', 4)
+    path = str(tmp_path / 'lid.sqlite')
+    cache = LidCache(path=path)
+    for i in range(5):
+        keys, _ = cache.get_many('model', [f'text {i}'])
+        cache.put_many(keys, [{'lang': ['eng'], 'prob': [1.0]}])
+    assert stored(path) == 4
+    cache.close()
+    assert stored(path) == 5
@@ -0,0 +1,14 @@
+from hplt_textpipes.lid.engine import LidEngine
+
+
+def test_script_shortcircuit_marked(lid_model):
+    engine = LidEngine(lid_model, 'openlid-v3', script_shortcircuit=True)
+    georgian, english = engine.predict_batch(['ეს არის ქართული ტექსტი', 'the cat sat on the mat', ''])[:2]
+    assert georgian == {'lang': ['kat_Geor'], 'prob': [1.0], 'shortcut': True}
+    assert 'shortcut' not in english and len(english['lang']) == 3
+
+
+def test_script_verify_returns_model_results(lid_model):
+    engine = LidEngine(lid_model, 'openlid-v3', script_shortcircuit=True, script_verify=True)
+    result = engine.predict_text('ეს არის ქართული ტექსტი')
+    assert 'shortcut' not in result and len(result['lang']) == 3
@@ -0,0 +1,28 @@
+import pytest
+
+from hplt_textpipes.bench.lid_preprocess import EDGE_CASES, generate_texts, preprocess_text as preprocess_stage2
+from hplt_textpipes.lid.preprocessing import preprocess_text, preprocess_texts, replace_newlines, \
+    strip_replace_newlines
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 1000])
+def test_preprocess_texts_multilingual(batch_size):
+    # texts in several languages and scripts, with the edge cases among their words
+    texts = generate_texts(3000, seed=batch_size) + EDGE_CASES
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i + batch_size]
+        assert preprocess_texts(batch) == [preprocess_stage2(t) for t in batch]
+
+
+@pytest.mark.parametrize('text', EDGE_CASES + [' ' + t + ' ' for t in EDGE_CASES])
+def test_preprocess_edge_cases(text):
+    expected = preprocess_stage2(text)
+    assert preprocess_texts([text]) == [expected]
+    assert preprocess_text(text) == expected
+    # alone and among the other edge cases, around the sentinels joining them
+    assert preprocess_texts(['ΟΔΟΣ', text, 'x']) == [preprocess_stage2('ΟΔΟΣ'), expected, 'x']
+
+
+def test_newlines_preprocessing():
+    assert replace_newlines([' a\nb\xa0']) == [' a b\xa0']
+    assert strip_replace_newlines([' a\nb\xa0']) == ['a b']
@@ -0,0 +1,12 @@
+from hplt_textpipes.lid.registry import resolve_model_path
+
+
+def test_openlid_v2_falls_back_to_old_file_name(tmp_path, monkeypatch):
+    monkeypatch.setenv('HPLT_CACHE', str(tmp_path))
+    assert resolve_model_path('openlid-v2') is None
+    (tmp_path / 'openlid-v2.bin').touch()
+    assert resolve_model_path('openlid-v2') == str(tmp_path / 'openlid-v2.bin')
+    (tmp_path / 'openlid_v2_180325.bin').touch()
+    assert resolve_model_path('openlid-v2') == str(tmp_path / 'openlid_v2_180325.bin')
+    # zstdconcat.py prefers the file it loaded before the registry
+    assert resolve_model_path('openlid-v2', str(tmp_path / 'openlid-v2.bin')) == str(tmp_path / 'openlid-v2.bin')
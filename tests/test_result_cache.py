@@ -0,0 +1,35 @@
+import sqlite3
+
+from hplt_textpipes.utils.result_cache import ResultCache
+
+
+def stored_bytes(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute('SELECT COALESCE(SUM(LENGTH(value)), 0) FROM cache').fetchone()[0]
+
+
+def test_size_limit_shared_by_instances(tmp_path):
+    # e.g. the LID caches of several workers sharing --lid_cache_path
+    path = str(tmp_path / 'cache.sqlite')
+    max_bytes = 10000
+    caches = [ResultCache(path, max_bytes), ResultCache(path, max_bytes)]
+    for i in range(90):
+        for j, cache in enumerate(caches):
+            cache.put(cache.key(f'{i} {j}'.encode()), bytes(100))
+            cache.commit()  # lets the other instance write
+            assert stored_bytes(path) <= max_bytes
+    assert sum(cache.stats['evicted'] for cache in caches) > 0
+    for cache in caches:
+        cache.close()
+    assert ResultCache(path, max_bytes)._total == stored_bytes(path)
+
+
+def test_replacing_value_updates_size(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    with ResultCache(path, 10000) as cache:
+        key = cache.key(b'doc')
+        cache.put(key, bytes(100))
+        cache.put(key, bytes(300))
+        assert cache._total == 300
+        assert cache.get(key) == bytes(300)
+    assert stored_bytes(path) == 300
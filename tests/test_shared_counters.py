@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+import signal
+import time
+
+from hplt_textpipes.utils.shared_counters import SharedCounters
+from hplt_textpipes.utils.watchdog_pool import WatchdogPool
+
+_counters = None
+
+
+def _init(counters):
+    global _counters
+    _counters = counters
+    counters.claim()
+
+
+def _count_and_hang(item):
+    _counters.add(0)
+    _counters.add(1, item)
+    if item % 5 == 0:
+        time.sleep(60)  # killed by the watchdog
+    return item
+
+
+def test_counts_of_killed_workers():
+    counters = SharedCounters('q', 2, max_processes=8)
+    items = list(range(1, 21))
+    with WatchdogPool(2, _count_and_hang, 0.5, lambda item: None, initializer=_init, initargs=(counters,)) as pool:
+        results = pool.submit(items).result(timeout=60)
+        assert pool.killed == 4
+    assert results == [None if item % 5 == 0 else item for item in items]
+    # the replacements of the 4 killed workers took over their slots, keeping their counts
+    assert counters.totals() == [20, sum(items)]
+
+
+def test_slot_of_dead_process_reused():
+    counters = SharedCounters('d', 1, max_processes=2)
+    counters.add(0, 0.5)  # the slot of this process
+    ctx = multiprocessing.get_context('fork')
+    for _ in range(3):
+        p = ctx.Process(target=counters.add, args=(0, 1.0))
+        p.start()
+        p.join()
+        assert p.exitcode == 0
+    assert counters.totals() == [3.5]
+    assert counters.owners[0] == os.getpid()
+
+
+def test_killed_while_owning_slot():
+    counters = SharedCounters('q', 1, max_processes=2)
+    ctx = multiprocessing.get_context('fork')
+    p = ctx.Process(target=lambda: (counters.add(0, 7), time.sleep(60)))
+    p.start()
+    while counters.totals() != [7]:
+        time.sleep(0.01)
+    os.kill(p.pid, signal.SIGKILL)
+    p.join()
+    counters.add(0)
+    child = ctx.Process(target=counters.add, args=(0, 1))
+    child.start()
+    child.join(10)
+    assert child.exitcode == 0 and counters.totals() == [9]
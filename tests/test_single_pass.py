@@ -0,0 +1,14 @@
+from trafilatura.utils import load_html
+
+from hplt_textpipes.stage2.trafilatura.traf import traf_config, extract_two_pass, extract_single_pass
+
+PARAGRAPH = '<p>' + 'Other most news are of have life to first work was is, from was world as new only as. ' * 5 + '</p>'
+TABLE = '<table>' + '<tr><td>Life was of.</td><td>757</td></tr>' * 5 + '</table>'
+
+
+def test_heading_before_trailing_table():
+    html = f'<html><body><article>{PARAGRAPH * 4}<h2>City and are not be.</h2>{TABLE}</article></body></html>'
+    config = traf_config()
+    text, xml = extract_two_pass(load_html(html), config)
+    assert 'City' not in text
+    assert extract_single_pass(load_html(html), config) == (text, xml)
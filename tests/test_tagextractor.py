@@ -0,0 +1,24 @@
+import pytest
+from trafilatura.utils import load_html
+
+from hplt_textpipes.stage2.tagfilter.tagextractor import extract_lang_info, DocumentMetadataExtractor
+
+HTMLS = [
+    '<html lang="en"><head><meta http-equiv="content-language" content="en-GB"></head><body><p>hi</p></body></html>',
+    '<html><head><meta property="og:locale" content="fr_FR"></head><body><p>salut</p></body></html>',
+    # libxml2 keeps the <html> elements after </html> as extra top-level roots
+    '<html lang="en"><body><p>hi</p></body></html><html lang="fr"><p>salut</p></html>',
+    '<!DOCTYPE html><html lang="en"><body><p>hi</p></body></html>\n<!-- c --><html lang="de">',
+    '<html><body><p>hi</p></body></html><html lang="de"></html>',
+]
+
+
+@pytest.mark.parametrize('html', HTMLS)
+def test_lang_info_as_extract_lang_info(html):
+    tree = load_html(html)
+    assert DocumentMetadataExtractor().extract(tree) == dict(extract_lang_info(tree))
+
+
+def test_trailing_html_lang():
+    tree = load_html(HTMLS[2])
+    assert DocumentMetadataExtractor().extract(tree) == {'htmllang': ['en', 'fr']}
@@ -0,0 +1,11 @@
+import pytest
+
+from hplt_textpipes.stage2.tagfilter import tagfilter2
+from hplt_textpipes.stage2.tagfilter.tagfilter2 import TagFilter2
+
+
+def test_automaton_backend_requires_pyahocorasick(monkeypatch):
+    monkeypatch.setattr(tagfilter2, 'ahocorasick', None)
+    TagFilter2(backend='re')
+    with pytest.raises(ImportError, match='pyahocorasick'):
+        TagFilter2(backend='automaton')
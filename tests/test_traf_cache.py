@@ -0,0 +1,22 @@
+import subprocess
+import sys
+
+LINES = [
+    b'{"h":"<html><body><article><p>' + b'Caf\xe9 au lait and a croissant every morning in the old town. ' * 20
+    + b'</p></article></body></html>"}\n',
+    b'{"h":"<html lang=\\"en\\"><body><article><p>' + b'Plain valid text about the weather in spring. ' * 20
+    + b'</p></article></body></html>"}\n',
+]
+
+
+def traf(*args):
+    cmd = [sys.executable, '-m', 'hplt_textpipes.stage2.trafilatura.traf', *args]
+    return subprocess.run(cmd, input=b''.join(LINES), capture_output=True, check=True).stdout
+
+
+def test_cache_keeps_decoding_modes_apart(tmp_path):
+    cache = str(tmp_path / 'cache.sqlite')
+    expected = {mode: traf('--decoding_errors', mode) for mode in ('strict', 'ignore', 'replace')}
+    assert len(set(expected.values())) == 3
+    for mode in ('strict', 'ignore', 'replace', 'ignore'):
+        assert traf('--decoding_errors', mode, '--cache_path', cache) == expected[mode]
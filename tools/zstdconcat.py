@@ -7,7 +7,6 @@ import glob;
 import io;
 import orjson;
 import os;
-from pathlib import Path;
 import regex;
 from subprocess import Popen, PIPE;
 import sys;
@@ -96,22 +95,6 @@ def parse(chunk, trace, i):
             file = sys.stderr, flush = True);
   return result;
 
-NONWORD_REPLACE_PATTERN = regex.compile(r"[^\p{Word}\p{Zs}]|\d");
-SPACE_PATTERN = regex.compile(r"\s\s+")
-
-def lid(text, identity, model):
-  if text in {None, ""}: return {"lang": None};
-  if "openlid" in identity:
-    text = text.strip().replace('\n', ' ').lower();
-    text = SPACE_PATTERN.sub(" ", text);
-    text = NONWORD_REPLACE_PATTERN.sub("", text);
-  else:
-    text = text.strip().replace("\n", " ");
-  result = model.predict(text = text, k = 3, threshold = 0.0,
-                         on_unicode_error = "strict");
-  return {"lang": [_.removeprefix("__label__") for _ in result[0]],
-          "prob": [float(round(_, 4)) for _ in result[1]]};
-
 def pool(result, lids, i, md, outputs):
   if result is None or "t" not in result:
     print("zstdconcat.py: missing text field (#{}); exit"
@@ -123,7 +106,7 @@ def pool(result, lids, i, md, outputs):
   if len(lids):
     try:
       for identity, model in lids:
-        result[identity] = lid(text, identity, model);
+        result[identity] = model.predict_text(text);
     except Exception as error:
       print("zstdconcat.py: error in lid {} (#{}); exit"
             "".format(identity, i),
@@ -220,6 +203,9 @@ def main():
   parser.add_argument("--filter", type = str, default = None);
   parser.add_argument("--lid", action = "append", default = []);
   parser.add_argument("--pool", type = str);
+  parser.add_argument("--lid_cache", type = int, default = 0);
+  parser.add_argument("--lid_cache_path", type = str);
+  parser.add_argument("--lid_cache_mb", type = int, default = 1024);
   parser.add_argument("--compress", type = str);
   parser.add_argument("--bin", type = str);
   parser.add_argument("--trace", action = "count", default = 0);
@@ -301,18 +287,46 @@ def main():
   # initialize fastText model(s) if requested
   #
   lids = [];
+  cache = None;
   if len(arguments.lid):
-    import fasttext;
-    cache = os.path.join(Path.home(), ".cache", "hplt");
+    #
+    # predict with the LID engine shared with stage2 and stage3, models are
+    # found in $HPLT_CACHE or ~/.cache/hplt
+    #
+    _ = os.path.dirname(__file__);
+    sys.path.append(os.path.realpath(os.path.join(_, "../src")));
+    from hplt_textpipes.lid.engine import LidEngine;
+    from hplt_textpipes.lid.registry import \
+      model_cache_dir, preprocessing_for, resolve_model_path;
+    #
+    # optionally, reuse LID results for texts seen before, in memory and in
+    # an SQLite database shared across runs
+    #
+    if arguments.lid_cache or arguments.lid_cache_path:
+      from hplt_textpipes.utils.lid_cache import LidCache;
+      cache = LidCache(arguments.lid_cache, arguments.lid_cache_path,
+                       arguments.lid_cache_mb);
   for identity in arguments.lid:
-    _ = os.path.join(cache, identity + ".bin");
-    if not os.path.isfile(_):
+    #
+    # prefer <identity>.bin, the file zstdconcat.py always loaded, over the
+    # file registered for the identity, e.g. openlid_v2_180325.bin
+    #
+    _ = resolve_model_path(identity,
+                           os.path.join(model_cache_dir(), identity + ".bin"));
+    if _ is None:
       print("zstdconcat.py: missing model file for {}; exit."
             "".format(identity),
             file = sys.stderr, flush = True);
       sys.exit(1);
+    #
+    # unlike stage3, zstdconcat.py always stripped the texts, also for the
+    # models predicting on the texts as they are, e.g. GlotLID
+    #
+    preprocessing = preprocessing_for(identity);
+    if preprocessing == "newlines": preprocessing = "newlines_stripped";
     try:
-      model = fasttext.load_model(_);
+      model = LidEngine(_, identity, preprocessing = preprocessing,
+                        lid_cache = cache);
       lids.append((identity, model));
     except:
       print("zstdconcat.py: failed to initialize LID {}; exit."
@@ -431,6 +445,9 @@ def main():
   for _ in outputs.values(): _.close();
   for _ in bins.values():
     if isinstance(_, sharder): _.close();
+  if cache is not None:
+    cache.close();
+    cache.report("zstdconcat.py");
   if arguments.trace > 0:
     print("[{}] zstdconcat.py: processed {} {}{}input lines(s); {:.2f} seconds."
           "".format(now(), i + 1,